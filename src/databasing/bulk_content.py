@@ -0,0 +1,148 @@
+import argparse
+import time
+
+import numpy as np
+from sqlalchemy import insert
+
+from .database_model import *
+
+"""
+    Synthetic supply chains for load tests, generated as NumPy columns and inserted as plain rows in chunks.
+    premade_db_content builds ORM objects one at a time, which is fine for a few products but far too slow for
+    millions of requests and orders.
+
+    Every product is a chain of stockpoints, and every stockpoint after the second also gets a route from a random
+    earlier stockpoint, so that networks branch like BranchingProduct. Requests are spread over the routes at random,
+    each with one order on its requested delivery date. Dates are drawn like in forecasting.generate_random_requests:
+    registration uniformly over the last year, delivery time beta distributed around avg_delivery_time.
+    Orders before today are completed and delivered.
+
+    Run from the repository root with:
+    python -m src.databasing.bulk_content <products> <stockpoints per product> <orders> [--url <database url>]
+"""
+
+
+def chunked_insert(session, table, columns: dict, chunk_size=50_000) -> int:
+    # Inserts rows given as equally long column arrays, chunk_size rows per executemany on the Core table, which
+    # skips the ORM's per-row bookkeeping. Returns the number of rows.
+    names = list(columns)
+    n_rows = len(columns[names[0]])
+    for start in range(0, n_rows, chunk_size):
+        chunk = [np.asarray(column[start:start + chunk_size]).tolist() for column in columns.values()]
+        session.execute(insert(table.__table__), [dict(zip(names, row)) for row in zip(*chunk)])
+    return n_rows
+
+
+def next_id(session, table) -> int:
+    return (session.scalar(select(func.max(table.id))) or 0) + 1
+
+
+def network_columns(first_product_id, first_stockpoint_id, first_route_id, n_products, n_stockpoints, rng):
+    # Products, stockpoints and routes, with ids given up front so that rows can refer to each other
+    product_ids = np.arange(first_product_id, first_product_id + n_products)
+    products = {
+        'id': product_ids,
+        'name': [f'Product {product_id}' for product_id in product_ids],
+        'price': rng.integers(20_00, 200_00, n_products),
+    }
+
+    positions = np.tile(np.arange(n_stockpoints), n_products)
+    stockpoint_ids = first_stockpoint_id + np.arange(n_products * n_stockpoints)
+    stockpoints = {
+        'id': stockpoint_ids,
+        'product_id': np.repeat(product_ids, n_stockpoints),
+        'name': [f'Stockpoint {position + 1}' for position in positions],
+        'current_stock': rng.integers(0, 20, n_products * n_stockpoints) * 50,
+    }
+
+    # The chain, from each stockpoint to the next
+    chained = positions > 0
+    receivers = [stockpoint_ids[chained]]
+    senders = [stockpoint_ids[chained] - 1]
+    # Branches, from a random stockpoint before the previous one, so that no route is repeated
+    branched = positions > 1
+    receivers.append(stockpoint_ids[branched])
+    senders.append(stockpoint_ids[branched] - 2 - (rng.random(branched.sum()) * (positions[branched] - 1)).astype(int))
+
+    receivers, senders = np.concatenate(receivers), np.concatenate(senders)
+    n_routes = len(receivers)
+    routes = {
+        'id': np.arange(first_route_id, first_route_id + n_routes),
+        'product_id': product_ids[(receivers - first_stockpoint_id) // n_stockpoints],
+        'sender_id': senders,
+        'receiver_id': receivers,
+        'capacity': rng.integers(1, 10, n_routes) * 10,
+        'lead_time': rng.integers(1, 8, n_routes),
+    }
+    return products, stockpoints, routes
+
+
+def request_columns(first_request_id, route_ids, n_requests, rng, avg_delivery_time=8, max_quantity=200):
+    # Requests on random routes, and one order for each. The order completes the request if it is overdue.
+    today = np.datetime64(date.today(), 'D')
+    registered = today - rng.integers(0, 365, n_requests)
+    a, b = 2, 4  # Alpha and Beta for the beta distribution, as in generate_random_requests
+    delivery_times = ((a + b) / a * rng.beta(a, b, n_requests) * avg_delivery_time).astype(int)
+    requested = registered + delivery_times
+    quantities = rng.integers(1, max_quantity + 1, n_requests)
+    completed = (requested < today).astype(int)
+
+    request_ids = np.arange(first_request_id, first_request_id + n_requests)
+    requests = {
+        'id': request_ids,
+        'route_id': rng.choice(np.asarray(route_ids), n_requests),
+        'date_of_registration': registered,
+        'requested_delivery_date': requested,
+        'quantity': quantities,
+        'quantity_delivered': quantities * completed,
+    }
+    orders = {
+        'request_id': request_ids,
+        'quantity': quantities,
+        'order_date': requested,
+        'completion_status': completed,
+    }
+    return requests, orders
+
+
+def generate_network(session, n_products, n_stockpoints, n_orders, chunk_size=50_000, seed=None) -> dict:
+    # Adds n_products products of n_stockpoints stockpoints each, and n_orders requests with one order each.
+    # Returns the number of rows inserted per table. The caller commits.
+    if n_products < 1 or n_stockpoints < 2:
+        raise ValueError("A network needs at least one product and two stockpoints per product.")
+    rng = np.random.default_rng(seed)
+
+    products, stockpoints, routes = network_columns(next_id(session, Product), next_id(session, StockPoint),
+                                                    next_id(session, SupplyRoute), n_products, n_stockpoints, rng)
+    requests, orders = request_columns(next_id(session, MoveRequest), routes['id'], n_orders, rng)
+
+    inserted = {}
+    for table, columns in [(Product, products), (StockPoint, stockpoints), (SupplyRoute, routes),
+                           (MoveRequest, requests), (MoveOrder, orders)]:
+        inserted[table.__tablename__] = chunked_insert(session, table, columns, chunk_size)
+    touch_stockpoints(session, *stockpoints['id'].tolist())
+    return inserted
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fill a database with a synthetic supply chain network.")
+    parser.add_argument('products', type=int)
+    parser.add_argument('stockpoints', type=int, help="Stockpoints per product")
+    parser.add_argument('orders', type=int, help="Requests, each with one order")
+    parser.add_argument('--url', default="sqlite+pysqlite:///:memory:", help="Database URL. Existing tables are reset.")
+    parser.add_argument('--chunk-size', type=int, default=50_000)
+    parser.add_argument('--seed', type=int)
+    args = parser.parse_args()
+
+    bulk_engine = create_engine(args.url, echo=False, future=True)
+    reset_db(bulk_engine)
+    with Session(bulk_engine) as bulk_session:
+        start = time.perf_counter()
+        rows = generate_network(bulk_session, args.products, args.stockpoints, args.orders, args.chunk_size,
+                                args.seed)
+        bulk_session.commit()
+        seconds = time.perf_counter() - start
+
+    for table_name, n_rows in rows.items():
+        print(f'{table_name:>14}: {n_rows:>10,} rows')
+    print(f'{sum(rows.values()):,} rows in {seconds:.2f} s: {sum(rows.values()) / seconds:,.0f} rows/s')
@@ -1,11 +1,17 @@
+import os
+import itertools
+import threading
+import weakref
 from typing import List, Optional
 from datetime import date, timedelta
 
-from sqlalchemy import Column, String, Table, Date, ForeignKey
+import numpy as np
+
+from sqlalchemy import Column, String, Table, Date, ForeignKey, Index
 from sqlalchemy import CheckConstraint, UniqueConstraint
-from sqlalchemy import create_engine, select, exc, update, URL
+from sqlalchemy import create_engine, select, exc, update, func, or_, false, case, event
 
-from sqlalchemy.orm import Mapped, mapped_column, relationship
+from sqlalchemy.orm import Mapped, mapped_column, relationship, joinedload
 from sqlalchemy.orm import declarative_base
 from sqlalchemy.orm import Session
 
@@ -39,7 +45,7 @@ class StockPoint(Base):
     name: Mapped[str] = mapped_column(String(30))
 
     # Relationships
-    product_id = mapped_column(ForeignKey("product_base.id"), nullable=False)
+    product_id = mapped_column(ForeignKey("product_base.id"), nullable=False, index=True)
     product: Mapped[Product] = relationship(back_populates="stock_points")
 
     # Variables
@@ -52,19 +58,20 @@ class StockPoint(Base):
 # For one-to-one BOM architecture
 class SupplyRoute(Base):
     __tablename__ = "supply_route"
+    # The unique constraint also indexes sender_id, as its leading column
     __table_args__ = (UniqueConstraint("sender_id", "receiver_id", name="Not_route_to_self"),)
 
     # Identity
     id: Mapped[int] = mapped_column(primary_key=True)
 
     # Relationships
-    product_id = mapped_column(ForeignKey("product_base.id"), nullable=False)
+    product_id = mapped_column(ForeignKey("product_base.id"), nullable=False, index=True)
     product: Mapped[Product] = relationship(back_populates="supply_routes")
 
     sender_id: Mapped[int] = mapped_column(ForeignKey("stock_point.id"))
     sender: Mapped[StockPoint] = relationship(foreign_keys=sender_id)
 
-    receiver_id: Mapped[int] = mapped_column(ForeignKey("stock_point.id"))
+    receiver_id: Mapped[int] = mapped_column(ForeignKey("stock_point.id"), index=True)
     receiver: Mapped[StockPoint] = relationship(foreign_keys=receiver_id)
 
     move_requests: Mapped[List["MoveRequest"]] = relationship(back_populates="route")
@@ -82,10 +89,23 @@ class SupplyRoute(Base):
             capability = self.capacity * (day - self.lead_time + 1)
         return capability
 
+    def capability_curve(self, n_days: int) -> np.ndarray:
+        # capability(day) for every day in range(n_days), as one array
+        return capability_curves([self.capacity], [self.lead_time], n_days)[0]
+
     def __repr__(self):
         return f"Route {self.id}, {self.sender.name} -> {self.receiver.name}. "
 
 
+def capability_curves(capacities, lead_times, days) -> np.ndarray:
+    # Capability of many routes at once: one row per (capacity, lead_time) pair, one column per day.
+    # days is either a number of days from day 0, or an array of days.
+    days = np.arange(days, dtype=np.int64) if np.isscalar(days) else np.asarray(days, dtype=np.int64)
+    capacities = np.asarray(capacities, dtype=np.int64)[:, np.newaxis]
+    lead_times = np.asarray(lead_times, dtype=np.int64)[:, np.newaxis]
+    return np.maximum(days - lead_times + 1, 0) * capacities
+
+
 class MoveRequest(Base):
     __tablename__ = "move_request"
 
@@ -93,7 +113,7 @@ class MoveRequest(Base):
     id: Mapped[int] = mapped_column(primary_key=True)
 
     # Relationships
-    route_id = mapped_column(ForeignKey("supply_route.id"), nullable=False)
+    route_id = mapped_column(ForeignKey("supply_route.id"), nullable=False, index=True)
     route: Mapped[SupplyRoute] = relationship(back_populates="move_requests")
 
     move_orders: Mapped[List["MoveOrder"]] = relationship(back_populates="request")
@@ -105,6 +125,7 @@ class MoveRequest(Base):
     quantity_delivered: Mapped[int] = mapped_column(default=0)
 
     def unanswered_quantity(self):
+        # Loads this request's orders. For many requests, use get_open_requests or unanswered_quantities instead.
         return self.quantity - sum([order.quantity for order in self.move_orders])
 
     def __repr__(self):
@@ -114,6 +135,12 @@ class MoveRequest(Base):
 
 class MoveOrder(Base):
     __tablename__ = "move_order"
+    __table_args__ = (
+        # execute_scheduled / get_scheduled_orders: pending orders on one day
+        Index("ix_move_order_status_date", "completion_status", "order_date", "request_id", "quantity"),
+        # Projections reach orders through their request. Covers the status, date and quantity filters and columns.
+        Index("ix_move_order_request_status_date", "request_id", "completion_status", "order_date", "quantity"),
+    )
 
     # Identity
     id: Mapped[int] = mapped_column(primary_key=True)
@@ -137,6 +164,110 @@ test_engine = create_engine("sqlite+pysqlite:///:memory:", echo=False, future=Tr
 Base.metadata.create_all(test_engine)
 
 
+""" Application engine: one per process, shared by all clients through its connection pool """
+
+default_db_url = "sqlite+pysqlite:///ctp_dashboard.db"
+
+
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    # Write-ahead logging lets readers keep going while another connection writes
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.close()
+
+
+def create_app_engine(url=None):
+    # Any SQLAlchemy URL. Defaults to the CTP_DATABASE_URL environment variable, then to a SQLite file.
+    url = url or os.environ.get("CTP_DATABASE_URL", default_db_url)
+    engine = create_engine(url, echo=False, future=True)
+    if engine.dialect.name == "sqlite":
+        event.listen(engine, "connect", set_sqlite_pragmas)
+    return engine
+
+
+""" Data versions: bumped for a stockpoint when a commit changes its orders or stock, so cached results can expire """
+
+
+class DataVersions:
+    serials = itertools.count()  # Ids of engines can be reused once they are garbage collected, these never are
+
+    def __init__(self):
+        self.serial = next(self.serials)
+        self.epoch = 0  # Bumped when the whole database is reset
+        self.versions = {}
+        self.lock = threading.Lock()  # Sessions in different threads commit concurrently
+
+    def get(self, stockpoint_id):
+        with self.lock:
+            return self.epoch, self.versions.get(stockpoint_id, 0)
+
+    def bump(self, stockpoint_ids):
+        with self.lock:
+            for stockpoint_id in stockpoint_ids:
+                self.versions[stockpoint_id] = self.versions.get(stockpoint_id, 0) + 1
+
+    def bump_all(self):
+        with self.lock:
+            self.epoch += 1
+
+
+engine_data_versions = weakref.WeakKeyDictionary()
+engine_data_versions_lock = threading.Lock()
+
+
+def data_versions(bind) -> DataVersions:
+    # One set of versions per engine: stockpoint ids only identify a stockpoint within one database
+    engine = bind.engine
+    with engine_data_versions_lock:
+        if engine not in engine_data_versions:
+            engine_data_versions[engine] = DataVersions()
+        return engine_data_versions[engine]
+
+
+def touch_stockpoints(session, *stockpoint_ids):
+    # Remembered on the session, and only bumped once the changes are committed
+    session.info.setdefault('touched_stockpoints', set()).update(stockpoint_ids)
+
+
+@event.listens_for(Session, "after_flush")
+def touch_flushed_stockpoints(session, flush_context):
+    # Every ORM write to stock, routes, requests or orders touches the stockpoints whose projections it changes, so
+    # that no caller has to remember to. Core statements bypass the flush, and touch their stockpoints themselves.
+    stockpoint_ids, route_ids, request_ids = set(), set(), set()
+    for item in itertools.chain(session.new, session.dirty, session.deleted):
+        if isinstance(item, StockPoint):
+            stockpoint_ids.add(item.id)
+        elif isinstance(item, SupplyRoute):
+            stockpoint_ids.update((item.sender_id, item.receiver_id))
+        elif isinstance(item, MoveRequest):
+            route_ids.add(item.route_id)
+        elif isinstance(item, MoveOrder):
+            request_ids.add(item.request_id)
+
+    if request_ids:
+        route_ids.update(session.scalars(select(MoveRequest.route_id).where(MoveRequest.id.in_(request_ids))))
+    if route_ids:
+        stmt = select(SupplyRoute.sender_id, SupplyRoute.receiver_id).where(SupplyRoute.id.in_(route_ids))
+        for sender_id, receiver_id in session.execute(stmt):
+            stockpoint_ids.update((sender_id, receiver_id))
+    stockpoint_ids.discard(None)
+    if stockpoint_ids:
+        touch_stockpoints(session, *stockpoint_ids)
+
+
+@event.listens_for(Session, "after_commit")
+def bump_touched_stockpoints(session):
+    touched = session.info.pop('touched_stockpoints', ())
+    if touched:
+        data_versions(session.get_bind()).bump(touched)
+
+
+@event.listens_for(Session, "after_rollback")
+def forget_touched_stockpoints(session):
+    session.info.pop('touched_stockpoints', None)
+
+
 """ Core database functions """
 
 
@@ -162,6 +293,7 @@ def run_with_session(engine, func, **kwargs):
 def reset_db(engine):
     Base.metadata.drop_all(engine)
     Base.metadata.create_all(engine)
+    data_versions(engine).bump_all()
 
 
 def get_all_by_name(session, table, element_name: str):
@@ -179,6 +311,67 @@ def get_all(session, table):
     return session.scalars(stmt).all()
 
 
+""" Eager loading of the relationship chains walked by __repr__, execute_scheduled_range and the allocator """
+
+
+def route_details():
+    # Sender, receiver and product of a route. StockPoint.__repr__ also needs the stockpoint's product.
+    return (joinedload(SupplyRoute.sender).joinedload(StockPoint.product),
+            joinedload(SupplyRoute.receiver).joinedload(StockPoint.product),
+            joinedload(SupplyRoute.product))
+
+
+def eager_options(table):
+    options = {
+        MoveRequest: (joinedload(MoveRequest.route).options(*route_details()),),
+        MoveOrder: (joinedload(MoveOrder.request).joinedload(MoveRequest.route).options(*route_details()),),
+    }
+    return options.get(table, ())
+
+
+def children_stmt(table, parent=None):
+    # All rows of table, or only those belonging to parent: a Product's StockPoints and SupplyRoutes, or a
+    # SupplyRoute's MoveRequests and MoveOrders.
+    stmt = select(table)
+    if parent is None:
+        return stmt
+    elif table is MoveOrder:
+        return stmt.join(MoveOrder.request).where(MoveRequest.route_id == parent.id)
+    elif table is MoveRequest:
+        return stmt.where(MoveRequest.route_id == parent.id)
+    elif table in (StockPoint, SupplyRoute):
+        return stmt.where(table.product_id == parent.id)
+    else:
+        raise ValueError(f'{table} has no parent table')
+
+
+def get_children(session, table, parent=None, limit=None, offset=0):
+    stmt = children_stmt(table, parent).order_by(table.id).limit(limit).offset(offset)
+    return session.scalars(stmt).all()
+
+
+def count_children(session, table, parent=None):
+    stmt = select(func.count()).select_from(children_stmt(table, parent).subquery())
+    return session.scalar(stmt)
+
+
+class QueryCounter:
+    """ Counts the SQL statements an engine executes inside a with-block. """
+    def __init__(self, engine):
+        self.engine = engine
+        self.count = 0
+
+    def __enter__(self):
+        event.listen(self.engine, "before_cursor_execute", self.increment)
+        return self
+
+    def __exit__(self, *exc_info):
+        event.remove(self.engine, "before_cursor_execute", self.increment)
+
+    def increment(self, *args):
+        self.count += 1
+
+
 """ Database modification functions """
 
 
@@ -199,6 +392,16 @@ def add_from_class_if_db_is_empty(session, input_class):
         run_in_session(session, add_from_class, input_class=input_class)
 
 
+def fill_db_if_empty(engine, input_classes):
+    # Creates missing tables, and only seeds when there are no products. Existing data is kept.
+    Base.metadata.create_all(engine)
+    with Session(engine) as session:
+        if session.scalars(select(Product)).first() is None:
+            for input_class in input_classes:
+                add_from_class(session, input_class)
+            session.commit()
+
+
 def add_request(session, route, req_date, quantity):
     reg_date = date.today()
     request = MoveRequest(route=route, date_of_registration=reg_date, requested_delivery_date=req_date, quantity=quantity)
@@ -239,11 +442,77 @@ def execute_scheduled(session, day):
         execute_move(session, order)
 
 
+def execute_scheduled_range(session: Session, start_date: date, end_date: date, chunk_size=500):
+    # Executes all pending orders from start_date to end_date with a few set-based statements instead of
+    # execute_move per order. Orders are validated like execute_move, in chronological order, against the stock
+    # left by the orders executed before them. Returns the executed order ids and (order id, reason) for rejected ones.
+    if end_date < start_date:
+        raise ValueError(f"End date ({end_date}) cannot be earlier than Start date ({start_date})")
+
+    stmt = (
+        select(MoveOrder.id, MoveOrder.request_id, MoveOrder.quantity, SupplyRoute.sender_id, SupplyRoute.receiver_id).
+        select_from(MoveOrder).
+        join(MoveOrder.request).
+        join(MoveRequest.route).
+        where(MoveOrder.completion_status == 0).
+        where(MoveOrder.order_date.between(start_date, end_date)).
+        order_by(MoveOrder.order_date, MoveOrder.id)
+    )
+    orders = session.execute(stmt).all()
+    stockpoint_ids = {order.sender_id for order in orders} | {order.receiver_id for order in orders}
+    stock = dict(session.execute(
+        select(StockPoint.id, StockPoint.current_stock).where(StockPoint.id.in_(stockpoint_ids))).all())
+
+    executed, rejected = [], []
+    stock_changes, deliveries = {}, {}
+    for order in orders:
+        if not stock[order.sender_id] >= order.quantity:
+            rejected.append((order.id, "Cannot move more than the sender has!"))
+        elif order.quantity < 0 and abs(order.quantity) > stock[order.receiver_id]:
+            rejected.append((order.id, "Cannot reverse move more than the receiver has!"))
+        else:
+            stock[order.sender_id] -= order.quantity
+            stock[order.receiver_id] += order.quantity
+            stock_changes[order.sender_id] = stock_changes.get(order.sender_id, 0) - order.quantity
+            stock_changes[order.receiver_id] = stock_changes.get(order.receiver_id, 0) + order.quantity
+            deliveries[order.request_id] = deliveries.get(order.request_id, 0) + order.quantity
+            executed.append(order.id)
+
+    no_sync = {"synchronize_session": False}
+    for ids in chunks(executed, chunk_size):
+        session.execute(update(MoveOrder).where(MoveOrder.id.in_(ids)).values(completion_status=1),
+                        execution_options=no_sync)
+    for ids in chunks(list(deliveries), chunk_size):
+        delivered = case({request_id: deliveries[request_id] for request_id in ids}, value=MoveRequest.id)
+        session.execute(update(MoveRequest).where(MoveRequest.id.in_(ids)).
+                        values(quantity_delivered=MoveRequest.quantity_delivered + delivered),
+                        execution_options=no_sync)
+    for ids in chunks(list(stock_changes), chunk_size):
+        change = case({stockpoint_id: stock_changes[stockpoint_id] for stockpoint_id in ids}, value=StockPoint.id)
+        session.execute(update(StockPoint).where(StockPoint.id.in_(ids)).
+                        values(current_stock=StockPoint.current_stock + change),
+                        execution_options=no_sync)
+
+    # Objects already loaded in the session are refreshed from the database on next access
+    session.expire_all()
+    touch_stockpoints(session, *stock_changes)  # Core updates are not flushed, so are not seen by the flush hook
+    return executed, rejected
+
+
+def chunks(items: list, size: int):
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
 """ Filtered queries: """
 
 
 def get_scheduled_orders(session, day: date):
-    stmt = select(MoveOrder).where(MoveOrder.order_date == day).where(MoveOrder.completion_status == 0)
+    stmt = (
+        select(MoveOrder).
+        where(MoveOrder.order_date == day).
+        where(MoveOrder.completion_status == 0).
+        options(*eager_options(MoveOrder))
+    )
     return session.scalars(stmt).all()
 
 
@@ -262,7 +531,8 @@ def get_incoming_move_orders(session, stockpoint):
         select(MoveOrder).
         join(MoveOrder.request).
         join(MoveRequest.route).
-        where(SupplyRoute.receiver == stockpoint)
+        where(SupplyRoute.receiver == stockpoint).
+        order_by(MoveOrder.id)
     )
     return session.scalars(stmt).all()
 
@@ -272,11 +542,97 @@ def get_outgoing_move_orders(session, stockpoint):
         select(MoveOrder).
         join(MoveOrder.request).
         join(MoveRequest.route).
-        where(SupplyRoute.sender == stockpoint)
+        where(SupplyRoute.sender == stockpoint).
+        order_by(MoveOrder.id)
     )
     return session.scalars(stmt).all()
 
 
+def get_pending_product_moves(session, product, start_date: date, end_date: date):
+    # Pending quantities per (sender, receiver, day) for every route of a product, in one grouped query
+    stmt = (
+        select(SupplyRoute.sender_id, SupplyRoute.receiver_id, MoveOrder.order_date,
+               func.sum(MoveOrder.quantity).label('quantity')).
+        select_from(MoveOrder).
+        join(MoveOrder.request).
+        join(MoveRequest.route).
+        where(SupplyRoute.product_id == product.id).
+        where(MoveOrder.completion_status == 0).
+        where(MoveOrder.order_date.between(start_date, end_date)).
+        group_by(SupplyRoute.sender_id, SupplyRoute.receiver_id, MoveOrder.order_date)
+    )
+    return session.execute(stmt).all()
+
+
+def get_pending_route_moves(session, route_ids, start_date: date, end_date: date):
+    # Pending quantities per (route, day) for the given routes, in one grouped query
+    stmt = (
+        select(MoveRequest.route_id, MoveOrder.order_date, func.sum(MoveOrder.quantity).label('quantity')).
+        select_from(MoveOrder).
+        join(MoveOrder.request).
+        where(MoveRequest.route_id.in_(route_ids)).
+        where(MoveOrder.completion_status == 0).
+        where(MoveOrder.order_date.between(start_date, end_date)).
+        group_by(MoveRequest.route_id, MoveOrder.order_date)
+    )
+    return session.execute(stmt).all()
+
+
+def answered_quantities():
+    # Ordered quantity per request id, as a subquery to outer join to MoveRequest. Summing in a subquery keeps the
+    # outer query free of GROUP BY, so it can also load other columns (PostgreSQL and MySQL reject ungrouped ones).
+    return (
+        select(MoveOrder.request_id, func.sum(MoveOrder.quantity).label('quantity')).
+        group_by(MoveOrder.request_id).
+        subquery()
+    )
+
+
+def open_requests_stmt(route=None):
+    answered = answered_quantities()
+    unanswered = MoveRequest.quantity - func.coalesce(answered.c.quantity, 0)
+    stmt = (
+        select(MoveRequest, unanswered.label('unanswered_quantity')).
+        outerjoin(answered, answered.c.request_id == MoveRequest.id).
+        where(unanswered > 0).
+        options(*eager_options(MoveRequest)).
+        order_by(MoveRequest.id)
+    )
+    if route is not None:
+        stmt = stmt.where(MoveRequest.route_id == route.id)
+    return stmt
+
+
+def get_open_requests(session, route=None):
+    # (request, unanswered quantity) of every request, or every request on route, that its orders do not yet cover.
+    # From one query, instead of loading each request's orders.
+    return session.execute(open_requests_stmt(route)).all()
+
+
+def unanswered_quantities(session, request_ids) -> dict:
+    # Unanswered quantity of each request id, from one query
+    answered = answered_quantities()
+    stmt = (
+        select(MoveRequest.id, MoveRequest.quantity - func.coalesce(answered.c.quantity, 0)).
+        outerjoin(answered, answered.c.request_id == MoveRequest.id).
+        where(MoveRequest.id.in_(request_ids))
+    )
+    return dict(session.execute(stmt).all())
+
+
+def get_product_stockpoints(session, product):
+    stmt = select(StockPoint.id, StockPoint.name, StockPoint.current_stock).where(StockPoint.product_id == product.id)
+    return session.execute(stmt).all()
+
+
+def get_product_routes(session, product):
+    stmt = (
+        select(SupplyRoute.id, SupplyRoute.sender_id, SupplyRoute.receiver_id, SupplyRoute.capacity, SupplyRoute.lead_time).
+        where(SupplyRoute.product_id == product.id)
+    )
+    return session.execute(stmt).all()
+
+
 def completed_orders(orders: list[MoveOrder]):
     return list(filter(lambda order: order.completion_status == 1, orders))
 
@@ -292,18 +648,45 @@ def filter_by_date(orders, start_date: date, end_date: date):
         return list(filter(lambda order: start_date <= order.order_date <= end_date, orders))
 
 
-def order_filter(session, stockpoint, start_date, end_date, incoming: bool, outgoing: bool, completed_or_pending=None):
-    orders = []
+def filtered_orders_stmt(stockpoint, start_date, end_date, incoming: bool, outgoing: bool, completed_or_pending=None,
+                         columns=(MoveOrder,)):
+    # A date bound of None leaves that side of the order date range open
+    if start_date is not None and end_date is not None and end_date < start_date:
+        raise ValueError(f"End date ({end_date}) cannot be earlier than Start date ({start_date})")
+
+    directions = []
     if incoming:
-        orders += get_incoming_move_orders(session, stockpoint)
+        directions.append(SupplyRoute.receiver_id == stockpoint.id)
     if outgoing:
-        orders += get_outgoing_move_orders(session, stockpoint)
-
-    orders = filter_by_date(orders, start_date, end_date)
+        directions.append(SupplyRoute.sender_id == stockpoint.id)
 
+    stmt = (
+        select(*columns).
+        select_from(MoveOrder).
+        join(MoveOrder.request).
+        join(MoveRequest.route).
+        where(or_(false(), *directions)).
+        # Incoming orders before outgoing ones, as when the two lists were concatenated
+        order_by(case((SupplyRoute.receiver_id == stockpoint.id, 0), else_=1), MoveOrder.id)
+    )
+    if start_date is not None:
+        stmt = stmt.where(MoveOrder.order_date >= start_date)
+    if end_date is not None:
+        stmt = stmt.where(MoveOrder.order_date <= end_date)
     if completed_or_pending == 'completed':
-        return completed_orders(orders)
+        stmt = stmt.where(MoveOrder.completion_status == 1)
     elif completed_or_pending == 'pending':
-        return uncompleted_orders(orders)
-    else:
-        return orders
+        stmt = stmt.where(MoveOrder.completion_status == 0)
+    return stmt
+
+
+def order_filter(session, stockpoint, start_date, end_date, incoming: bool, outgoing: bool, completed_or_pending=None):
+    stmt = filtered_orders_stmt(stockpoint, start_date, end_date, incoming, outgoing, completed_or_pending)
+    return session.scalars(stmt).all()
+
+
+def order_quantities(session, stockpoint, start_date, end_date, incoming: bool, outgoing: bool, completed_or_pending=None):
+    # Same filtering as order_filter, but returns lightweight (id, request_id, order_date, quantity) rows
+    columns = (MoveOrder.id, MoveOrder.request_id, MoveOrder.order_date, MoveOrder.quantity)
+    stmt = filtered_orders_stmt(stockpoint, start_date, end_date, incoming, outgoing, completed_or_pending, columns)
+    return session.execute(stmt).all()
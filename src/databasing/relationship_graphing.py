@@ -1,4 +1,5 @@
-from os import remove
+import threading
+from collections import OrderedDict
 
 from pyvis.network import Network
 import networkx as nx
@@ -25,27 +26,106 @@ def product_to_graph(session, product: dbm.Product):
 """ When changing these, make sure to reactivate and run the tests in test_all """
 
 
-def graph_to_net(graph: nx.DiGraph):
-    pixel_height = str(230 + 50 * len(graph.edges))
-    net = Network(height=f'{pixel_height}px', width=f'{pixel_height}px', directed=True)
+# Pixels between layers, between nodes in a layer, and around the graph
+layer_spacing = 250
+node_spacing = 120
+canvas_margin = 100
+max_canvas_pixels = 1600
+
+
+def graph_layers(graph: nx.DiGraph) -> list[list]:
+    # Senders before receivers: topological generations, with any cycles kept together in one layer
+    condensed = nx.condensation(graph)
+    return [sorted(node for component in generation for node in condensed.nodes[component]['members'])
+            for generation in nx.topological_generations(condensed)]
+
+
+def layered_layout(graph: nx.DiGraph, sweeps=4) -> dict:
+    # Fixed (x, y) of every node, with one column per layer. Within a layer, nodes are ordered by the barycenter
+    # of their neighbours in the previous layers, sweeping down and up, to untangle the routes.
+    layers = graph_layers(graph)
+    row = {node: i for layer in layers for i, node in enumerate(layer)}
+
+    def order_by_barycenter(layer, neighbours):
+        def barycenter(node):
+            rows = [row[neighbour] for neighbour in neighbours(node)]
+            return sum(rows) / len(rows) if rows else row[node]
+        layer.sort(key=barycenter)
+        row.update({node: i for i, node in enumerate(layer)})
+
+    for _ in range(sweeps):
+        for layer in layers[1:]:
+            order_by_barycenter(layer, graph.predecessors)
+        for layer in reversed(layers[:-1]):
+            order_by_barycenter(layer, graph.successors)
+
+    return {node: (x * layer_spacing, (i - (len(layer) - 1) / 2) * node_spacing)
+            for x, layer in enumerate(layers) for i, node in enumerate(layer)}
+
+
+def canvas_size(layout: dict) -> tuple[int, int]:
+    # Width and height in pixels that fit the layout, within max_canvas_pixels. vis.js zooms larger graphs to fit.
+    if not layout:
+        return 2 * canvas_margin, 2 * canvas_margin
+    xs, ys = [x for x, _ in layout.values()], [y for _, y in layout.values()]
+    width = int(max(xs) - min(xs)) + 2 * canvas_margin
+    height = int(max(ys) - min(ys)) + 2 * canvas_margin
+    return min(width, max_canvas_pixels), min(height, max_canvas_pixels)
+
+
+def graph_to_net(graph: nx.DiGraph, layout=None):
+    # Node positions are computed here, so that the browser does no layout work
+    layout = layered_layout(graph) if layout is None else layout
+    width, height = canvas_size(layout)
+    net = Network(height=f'{height}px', width=f'{width}px', directed=True)
     net.toggle_physics(False)
     net.from_nx(graph)
+    for node in net.nodes:
+        node['x'], node['y'] = layout[node['id']]
+        node['physics'] = False
     return net
 
 
-# Should be redundant with the string already existing as net.html, but isn't...
 def net_to_html_str(net: Network):
-    filename = 'net.html'
-    net.write_html(filename)
-    remove(filename)
-    return net.html
+    # Rendered in memory: no net.html or lib/ folder in the working directory, which concurrent requests would share
+    return net.generate_html()
 
 
-def product_to_html_str(session, product):
+def product_topology(product: dbm.Product) -> tuple:
+    # Everything the rendered graph depends on: stockpoints with their labels, and routes with their ends
+    stockpoints = tuple(sorted((stockpoint.id, stockpoint.name) for stockpoint in product.stock_points))
+    routes = tuple(sorted((route.id, route.sender_id, route.receiver_id) for route in product.supply_routes))
+    return stockpoints, routes
+
+
+# Rendered graphs and their canvas sizes by product topology, least recently used first
+html_cache = OrderedDict()
+html_cache_size = 64
+html_cache_lock = threading.Lock()
+
+
+def product_to_html(session, product) -> tuple[str, int, int]:
+    # HTML of the product's graph, with the width and height of its canvas in pixels
+    key = product_topology(product)
+    with html_cache_lock:
+        if key in html_cache:
+            html_cache.move_to_end(key)
+            return html_cache[key]
+
     sc_graph = product_to_graph(session, product)
-    net = graph_to_net(sc_graph)
-    html_string = net_to_html_str(net)
-    return html_string
+    layout = layered_layout(sc_graph)
+    net = graph_to_net(sc_graph, layout)
+    rendered = (net_to_html_str(net), *canvas_size(layout))
+
+    with html_cache_lock:
+        html_cache[key] = rendered
+        while len(html_cache) > html_cache_size:
+            html_cache.popitem(last=False)
+    return rendered
+
+
+def product_to_html_str(session, product):
+    return product_to_html(session, product)[0]
 
 
 """ WARNING: Tests for these three functions are commented out by default, to avoid html spam when running test_all"""
@@ -16,6 +16,7 @@ from databasing.database_model import *
     If the distribution by default returns values in its own range, such as 0 < x < 1, include rescale= at the end.
     """
 
+# For load tests with many requests, databasing.bulk_content draws the same dates as NumPy columns and inserts rows.
 def generate_random_requests(n, status, earliest_reg_date, last_reg_date, avg_requested_delivery_time,
                              quantity_distribution, *args, **rescale):
 
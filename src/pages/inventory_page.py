@@ -1,12 +1,14 @@
 import os
 import uuid
+from functools import lru_cache
 
-import pandas as pd
+import numpy as np
 from h2o_wave import Q, ui, data
 
 from ..databasing import database_model as dbm
-from ..projection import StockProjection, ProjectionCTP
-from .shared_content import get_selected, DbContent, product_dropdown, stockpoint_choice_group, force_select_child_in_selected_parent
+from ..projection import ProjectionCTP, ProjectionResult, ProjectionPeriod, projection_cache
+from .shared_content import get_selected, DbContent, product_dropdown, stockpoint_choice_group, force_select_child_in_selected_parent, \
+    show_card
 
 
 
@@ -22,7 +24,7 @@ column_plot_styles = {
 
 
 def layout(q: Q):
-    q.page['meta'] = ui.meta_card(box='', layouts=[
+    show_card(q, 'meta', ui.meta_card(box='', layouts=[
         ui.layout(
             breakpoint='s',
             zones=[
@@ -55,18 +57,19 @@ def layout(q: Q):
                 ])
             ]
         )
-    ])
+    ]))
 
 
-async def serve_inventory_page(q: Q, session, db_content):
+def serve_inventory_page(q: Q, session, db_content):
 
     show_stockpoint_selection(q, session, 'inv_sp_selection_zone', trigger1=True)
 
-    await show_inventory_status(q, db_content, boxes=['inv_status_zone_a', 'inv_status_zone_b'])
-    await show_sp_move_orders(q, box='inv_status_zone_c')
+    show_inventory_status(q, db_content, boxes=['inv_status_zone_a', 'inv_status_zone_b'])
+    show_sp_move_orders(q, session, db_content.stockpoint, box='inv_status_zone_c')
 
     show_plot_controls(q)
-    projection = ProjectionCTP(session, db_content.stockpoint, q.client.plot_length)
+    # Rebuilt only when the stockpoint's orders or stock have changed, so plot controls just slice the cached result
+    projection = projection_cache.get(session, db_content.stockpoint, ProjectionCTP)
     show_plot(q, projection, plot_period=q.client.plot_length)
 
 
@@ -75,7 +78,7 @@ def show_stockpoint_selection(q: Q, session, box, trigger1=True, trigger2=True):
     product_chooser = product_dropdown(q, session, trigger=trigger1, width='300px')
     stockpoint_chooser = stockpoint_choice_group(q, session, inline=True, trigger=trigger2)
 
-    q.page['stockpoint_selection'] = ui.form_card(
+    show_card(q, 'stockpoint_selection', ui.form_card(
         box=box,
         items=[
             ui.text_l(content="Stockpoint Selection"),
@@ -84,44 +87,40 @@ def show_stockpoint_selection(q: Q, session, box, trigger1=True, trigger2=True):
                 stockpoint_chooser
             ])
         ]
-    )
+    ))
 
 
-async def show_inventory_status(q: Q, db_content, boxes):
+def show_inventory_status(q: Q, db_content, boxes):
 
     in_stock = db_content.current_stock
     value_per_item = db_content.price / 100
     stock_value = in_stock * value_per_item
 
-    outgoing = [f'{route}\n' for route in db_content.outgoing_routes]
-
-    q.page['inv_about'] = ui.tall_stats_card(
+    show_card(q, 'inv_about', ui.tall_stats_card(
         box=boxes[0],
         items=[
             ui.stat(label='Product', value=f'{db_content.product.name}'),
             ui.stat(label='Stockpoint', value=f'{db_content.stockpoint.name}'),
         ]
-    )
+    ))
 
-    q.page['inv_status'] = ui.tall_stats_card(
+    show_card(q, 'inv_status', ui.tall_stats_card(
         box=boxes[-1],
         items=[
             ui.stat(label='Current Stock', value=f'{in_stock:,}'),
             ui.stat(label='Unit value, $', value=f'{value_per_item:,.2f},-'),
             ui.stat(label='Value of Stock, $', value=f'{stock_value:,.2f},-'),
         ]
-    )
-
+    ))
 
-async def show_sp_move_orders(q: Q, box):
-    # Get data from db
-    with dbm.Session(q.user.db_engine) as list_move_orders_session:
-        stockpoint = get_selected(q, list_move_orders_session, dbm.StockPoint)
 
-        incoming_moves = dbm.get_incoming_move_orders(list_move_orders_session, stockpoint)
-        outgoing_moves = dbm.get_outgoing_move_orders(list_move_orders_session, stockpoint)
-        pending_incoming = dbm.uncompleted_orders(incoming_moves)
-        pending_outgoing = dbm.uncompleted_orders(outgoing_moves)
+def show_sp_move_orders(q: Q, session, stockpoint, box):
+    # Get data from db, in the request's session: a second one would hold a second pooled connection per request
+    # Only the pending orders are loaded, filtered in SQL rather than from all of the stockpoint's orders
+    pending_incoming = dbm.order_filter(session, stockpoint, None, None, incoming=True, outgoing=False,
+                                        completed_or_pending='pending')
+    pending_outgoing = dbm.order_filter(session, stockpoint, None, None, incoming=False, outgoing=True,
+                                        completed_or_pending='pending')
 
     # Convert to H2O Wave content
     incoming_table = [
@@ -144,16 +143,16 @@ async def show_sp_move_orders(q: Q, box):
     full_table = incoming_table + outgoing_table
 
     # Show H2O Wave content
-    q.page['orders'] = ui.stat_table_card(
+    show_card(q, 'orders', ui.stat_table_card(
         box=box,
         title='Move Orders',
         columns=['ID', 'incoming/outgoing', 'Quantity', 'Planned Date', 'Completion Status', 'Request ID'],
         items=full_table
-    )
+    ))
 
 
 def show_plot_controls(q: Q):
-    q.page['controls'] = ui.form_card(
+    show_card(q, 'controls', ui.form_card(
         box='inv_control_zone',
         items=[
             ui.text_xl("Plot controls"),
@@ -162,19 +161,31 @@ def show_plot_controls(q: Q):
             ui.checklist(name='plot_columns', label='Include in plot:', values=q.client.plot_columns, inline=False,
                          choices=[ui.choice(name=col_name, label=col_name) for col_name in plotable_columns])
         ]
-    )
+    ))
 
 
-def show_plot(q: Q, projection: StockProjection, plot_period: int):
-    selected_columns = q.client.plot_columns
-    if selected_columns:
-        plot_frame: pd.DataFrame = projection.df.loc[projection.df.index[:plot_period], selected_columns].copy()
+@lru_cache(maxsize=32)
+def plot_dates(start_date, horizon, bucket) -> list[str]:
+    # ISO date of every bucket, formatted once per projection period instead of on every plot
+    dates_range = ProjectionPeriod(start_date, horizon, bucket).dates_range
+    return np.datetime_as_string(dates_range.to_numpy(), unit='D').tolist()
+
+
+def plot_payload(projection: ProjectionResult, selected_columns, plot_period: int):
+    # Packed column-wise plot data and y-axis limits, straight from the result's arrays
+    values = projection.values[[projection.columns.index(column) for column in selected_columns], :plot_period]
+    y_min = min(0, int(values.min() * 1.1))
+    y_max = max(20, int(values.max() * 1.1))
 
-        y_min = min(0, int(plot_frame.to_numpy().min() * 1.1))
-        y_max = max(20, int(plot_frame.to_numpy().max() * 1.1))
+    dates = plot_dates(projection.start_date, projection.horizon, projection.bucket)[:plot_period]
+    plot_data = data(fields=list(selected_columns) + ['date'], columns=values.tolist() + [dates], pack=True)
+    return plot_data, y_min, y_max
 
-        date_strings = [date.isoformat() for date in projection.dates_range[:plot_period]]
-        plot_frame['date'] = [date_string[:10] for date_string in date_strings]
+
+def show_plot(q: Q, projection: ProjectionResult, plot_period: int):
+    selected_columns = q.client.plot_columns
+    if selected_columns:
+        plot_data, y_min, y_max = plot_payload(projection, selected_columns, plot_period)
 
         plot_marks = []
         for column_name in selected_columns:
@@ -191,18 +202,18 @@ def show_plot(q: Q, projection: StockProjection, plot_period: int):
                 )
             )
 
-        q.page['plot'] = ui.plot_card(
+        show_card(q, 'plot', ui.plot_card(
             box='plot_zone',
             title=projection.__str__(),
-            data=data(fields=plot_frame.columns.tolist(), rows=plot_frame.values.tolist()),
+            data=plot_data,
             plot=ui.plot(marks=plot_marks)
-        )
+        ))
     else:
-        q.page['plot'] = ui.markdown_card(
+        show_card(q, 'plot', ui.markdown_card(
             box='plot_zone',
             title='No columns selected',
             content='No data column selected. Select at least one.'
-        )
+        ))
 
 
 # Legacy, not in use
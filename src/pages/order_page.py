@@ -3,11 +3,12 @@ import datetime
 from h2o_wave import Q, ui
 
 from ..databasing import database_model as dbm
-from .shared_content import get_selected, show_children, product_dropdown, supply_route_choice_group
+from ..projection import quote_requests
+from .shared_content import get_selected, show_children, product_dropdown, supply_route_choice_group, show_card
 
 
 def layout(q: Q):
-    q.page['meta'] = ui.meta_card(box='', layouts=[
+    show_card(q, 'meta', ui.meta_card(box='', layouts=[
         ui.layout(breakpoint='xs',
             zones=[
                 ui.zone('header_zone'),  # DO NOT CHANGE header_zone WITHOUT ALSO CHANGING IT IN OTHER PAGES
@@ -31,16 +32,22 @@ def layout(q: Q):
 
             ]
         )
-    ])
+    ]))
 
 
-async def serve_order_page(q:Q, session):
+def serve_order_page(q:Q, session):
     if q.args.show_move_requests:
-        show_children(q, session, dbm.MoveRequest, box='order_table_zone', parent=get_selected(q, session, dbm.SupplyRoute))
+        show_route_table(q, session, dbm.MoveRequest, page=0)
     elif q.args.show_move_orders:
-        show_children(q, session, dbm.MoveOrder, box='order_table_zone', parent=get_selected(q, session, dbm.SupplyRoute))
+        show_route_table(q, session, dbm.MoveOrder, page=0)
+    elif q.args.table_next_page:
+        show_route_table(q, session, q.client.route_table, page=q.client.route_table_page + 1)
+    elif q.args.table_previous_page:
+        show_route_table(q, session, q.client.route_table, page=max(0, q.client.route_table_page - 1))
     elif q.args.make_request:
         make_request(q)
+    elif q.args.quote_request:
+        quote_request(q, session)
     elif q.args.submit_request:
         submit_request(q, session)
         show_order_controls(q, session)
@@ -48,10 +55,19 @@ async def serve_order_page(q:Q, session):
         show_order_controls(q, session)
 
 
+def show_route_table(q: Q, session, db_table, page):
+    route = get_selected(q, session, dbm.SupplyRoute)
+    if route.id != q.client.route_table_route_id:
+        page = 0  # Another route's table starts from its first page
+    q.client.route_table = db_table
+    q.client.route_table_route_id = route.id
+    q.client.route_table_page = show_children(q, session, db_table, box='order_table_zone', parent=route, page=page)
+
+
 def show_order_controls(q: Q, session, message=''):
     product_selector = product_dropdown(q, session, trigger=True)
     route_selector = supply_route_choice_group(q, session, trigger=False)
-    q.page['sc_controls'] = ui.form_card(
+    show_card(q, 'sc_controls', ui.form_card(
         box='order_control_zone_a',
         items=[
             ui.text_l(message),
@@ -61,23 +77,37 @@ def show_order_controls(q: Q, session, message=''):
             ui.button(name='show_move_requests', label='Table: Move Requests'),
             ui.button(name='show_move_orders', label='Table: Move Orders')
         ]
-    )
+    ))
 
 
-def make_request(q: Q, message=''):
+def make_request(q: Q, message='', delivery_date=None, quantity=30):
     route_id = int(q.client.supply_route_selection)
-    default_date = datetime.date.today()
+    default_date = delivery_date or datetime.date.today()
     date_value = default_date.isoformat()
-    q.page['sc_controls'] = ui.form_card(
+    show_card(q, 'sc_controls', ui.form_card(
         box='order_control_zone_a',
         items=[
             ui.text_m(message),
             ui.text_l(f'Add Request to route {route_id}'),
             ui.date_picker(name='request_date_picker', label='Requested Delivery', value=date_value),
-            ui.spinbox(name='request_quantity', label='Requested Quantity', min=0, max=10000, value=30, step=1),
-            ui.button(name='submit_request', label='Submit Request')
+            ui.spinbox(name='request_quantity', label='Requested Quantity', min=0, max=10000, value=quantity, step=1),
+            ui.buttons(items=[
+                ui.button(name='submit_request', label='Submit Request'),
+                ui.button(name='quote_request', label='Earliest Date'),
+            ])
         ]
-    )
+    ))
+
+
+def quote_request(q: Q, session):
+    # Fills in the earliest date the route and its sender can both take the quantity, as confirming it would
+    quantity = int(q.client.request_quantity)
+    route = get_selected(q, session, dbm.SupplyRoute)
+    promise_date, = quote_requests(session, [(route, quantity)], column='CTP')
+    if promise_date:
+        make_request(q, f'{quantity} can be delivered from {promise_date.isoformat()}.', promise_date, quantity)
+    else:
+        make_request(q, f'{quantity} cannot be promised within a year.', quantity=quantity)
 
 
 def submit_request(q, session):
@@ -93,7 +123,7 @@ def submit_request(q, session):
 
 
 def show_welcome(q: Q):
-    q.page['welcome'] = ui.form_card(box='order_control_zone_b', items=[
+    show_card(q, 'welcome', ui.form_card(box='order_control_zone_b', items=[
         ui.text_l(f'Welcome, this page is empty'),
         ui.text(f"Nothing to see here yet. Please navigate to the other pages with the navigation header up top. ")
-    ])
\ No newline at end of file
+    ]))
\ No newline at end of file
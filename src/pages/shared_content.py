@@ -1,4 +1,5 @@
 from h2o_wave import Q, ui
+from h2o_wave.core import Data, marshal
 
 from ..databasing import database_model as dbm
 
@@ -31,6 +32,73 @@ def force_select_child_in_selected_parent(q: Q, session):
     q.client.stockpoint_selection = choose_child_stockpoint()
 
 
+def show_card(q: Q, name: str, card):
+    # Sends the whole card the first time, and afterwards only the fields that differ from what the client shows.
+    # Unchanged cards send nothing.
+    props = card.dump()
+    shown = q.client.shown_cards.get(name)
+    q.client.shown_cards[name] = props
+    if shown == props:
+        return
+
+    changes = card_changes(shown, props)
+    if changes is None:
+        q.page[name] = card
+        count_sent(q, props)
+        return
+    count_sent(q, changes)
+    card_ref = q.page[name]
+    for path, value in changes:
+        field_ref = card_ref
+        for key in path[:-1]:
+            field_ref = field_ref[key]
+        field_ref[path[-1]] = value
+
+
+def card_changes(shown, props):
+    # (path, value) of every changed field, or None when the whole card should be replaced: a new card, one that
+    # moved or changed type, the meta card, data buffers, or changes that are bigger than the card itself
+    if shown is None or props.get('view') == 'meta' or any(shown.get(key) != props.get(key) for key in ['view', 'box']):
+        return None
+    changes = list(field_changes(shown, props, ()))
+    if any(isinstance(value, Data) for _, value in changes):
+        return None
+    if len(marshal(changes)) >= len(marshal(props)):
+        return None
+    return changes
+
+
+def field_changes(shown, new, path):
+    if shown == new:
+        return
+    if isinstance(shown, dict) and isinstance(new, dict) and shown.keys() == new.keys():
+        for key in new:
+            yield from field_changes(shown[key], new[key], path + (key,))
+    elif isinstance(shown, list) and isinstance(new, list) and len(shown) == len(new):
+        for index, (shown_item, new_item) in enumerate(zip(shown, new)):
+            yield from field_changes(shown_item, new_item, path + (index,))
+    else:
+        yield path, new
+
+
+def count_sent(q: Q, content):
+    # Roughly what a card update adds to the page's next save, for the per-request total logged by the app
+    q.client.bytes_sent = (q.client.bytes_sent or 0) + len(marshal(content))
+
+
+def remove_card(q: Q, name: str):
+    if q.client.shown_cards.pop(name, None) is not None:
+        del q.page[name]
+        count_sent(q, name)
+
+
+def rebuild_page(q: Q):
+    # Deletes the client's page, so that the next cards are sent whole. show_card only knows what it sent, not what
+    # the Wave server holds, so the page is rebuilt whenever the two may have drifted apart.
+    q.page.drop()
+    q.client.shown_cards = {}
+
+
 class DbContent:
     def __init__(self, q: Q, session: dbm.Session, to_fetch=None):
 
@@ -103,64 +171,98 @@ def assemble_choices(q: Q, session, owner_category: dbm.Base, target_attr_in_own
             raise ValueError(f'{owner_category} and {target_attr_in_owner} is not a valid combination.')
 
 
-def table_of_all(q: Q, session, db_table: dbm.Base, conversion_dict):
+table_page_size = 50
+
 
-    all_items = dbm.get_all(session, db_table)
-    items = build_stat_table(all_items, conversion_dict)
+def table_of_all(q: Q, session, db_table: dbm.Base, conversion_dict, page=0, page_size=table_page_size):
+
+    all_items = dbm.get_children(session, db_table, limit=page_size, offset=page * page_size)
+    items = build_stat_table(all_items, conversion_dict, computed_columns(session, db_table, all_items))
     items = format_stat_table(items, db_table)
 
     return items
 
 
-def table_of_children(q: Q, session, db_table: dbm.Base, conversion_dict, parent):
-    all_items = dbm.get_all(session, db_table)
+def table_of_children(q: Q, session, db_table: dbm.Base, conversion_dict, parent, page=0, page_size=table_page_size):
+    # Only the requested page of the parent's children is queried
+    children = dbm.get_children(session, db_table, parent, limit=page_size, offset=page * page_size)
 
-    match db_table:
-        case dbm.MoveOrder:
-            children = list(filter(lambda order: order.request.route == parent, all_items))
-        case dbm.MoveRequest:
-            children = list(filter(lambda request: request.route == parent, all_items))
-        case dbm.SupplyRoute:
-            children = list(filter(lambda route: route.product == parent, all_items))
-        case dbm.StockPoint:
-            children = list(filter(lambda stockpoint: stockpoint.product == parent, all_items))
-        case _:
-            children = []
-
-    items = build_stat_table(children, conversion_dict)
+    items = build_stat_table(children, conversion_dict, computed_columns(session, db_table, children))
     items = format_stat_table(items, db_table)
 
     return items
 
 
-def show_table(q: Q, session, db_table: dbm.Base, box):
+def show_table(q: Q, session, db_table: dbm.Base, box, page=0):
+    # Shows one page of all rows of db_table, and returns the page shown
     title = db_table.__name__
 
     conversion_dict = table_conversion_dicts[db_table]
-    columns = [title] + list(conversion_dict.keys())
+    columns = [title] + list(conversion_dict.keys()) + list(table_computed_columns.get(db_table, {}))
 
-    items = table_of_all(q, session, db_table, conversion_dict)
+    n_rows = dbm.count_children(session, db_table)
+    page = min(page, last_page(n_rows))  # The table may have shrunk since the page was chosen
+    items = table_of_all(q, session, db_table, conversion_dict, page)
 
-    q.page['db_table'] = ui.stat_table_card(box=box, title=title+'s', columns=columns, items=items)
+    show_card(q, 'db_table', ui.stat_table_card(box=box, title=page_title(title, page, n_rows), columns=columns, items=items))
+    show_table_pager(q, box, page, n_rows)
+    return page
 
 
-def show_children(q: Q, session, db_table: dbm.Base, box, parent):
+def show_children(q: Q, session, db_table: dbm.Base, box, parent, page=0):
+    # Shows one page of parent's rows of db_table, and returns the page shown
     title = db_table.__name__
 
     conversion_dict = table_conversion_dicts[db_table]
-    columns = [title] + list(conversion_dict.keys())
+    columns = [title] + list(conversion_dict.keys()) + list(table_computed_columns.get(db_table, {}))
+
+    n_rows = dbm.count_children(session, db_table, parent)
+    page = min(page, last_page(n_rows))  # The table may have shrunk since the page was chosen
+    items = table_of_children(q, session, db_table, conversion_dict, parent, page)
 
-    items = table_of_children(q, session, db_table, conversion_dict, parent)
+    show_card(q, 'db_table', ui.stat_table_card(box=box, title=page_title(title, page, n_rows), columns=columns, items=items))
+    show_table_pager(q, box, page, n_rows)
+    return page
 
-    q.page['db_table'] = ui.stat_table_card(box=box, title=title+'s', columns=columns, items=items)
 
+def page_title(title, page, n_rows, page_size=table_page_size):
+    if n_rows <= page_size:
+        return title + 's'
+    first_row = page * page_size + 1
+    last_row = min(n_rows, (page + 1) * page_size)
+    return f'{title}s {first_row}-{last_row} of {n_rows}'
 
-def build_stat_table(items, conversion_dict):
-    colors = ['black'] * len(conversion_dict)
+
+def last_page(n_rows, page_size=table_page_size):
+    return max(n_rows - 1, 0) // page_size
+
+
+def show_table_pager(q: Q, box, page, n_rows, page_size=table_page_size):
+    # Previous/next buttons, only when the table has more than one page. The page's serve function handles them.
+    if n_rows <= page_size:
+        remove_card(q, 'db_table_pager')
+        return
+    show_card(q, 'db_table_pager', ui.form_card(box=box, items=[
+        ui.buttons(items=[
+            ui.button(name='table_previous_page', label='Previous', disabled=page <= 0),
+            ui.button(name='table_next_page', label='Next', disabled=page >= last_page(n_rows, page_size)),
+        ])
+    ]))
+
+
+def computed_columns(session, db_table, items) -> list[dict]:
+    # Values by item id of the table's computed columns, one query per column for the whole page
+    ids = [item.id for item in items]
+    return [query(session, ids) for query in table_computed_columns.get(db_table, {}).values()]
+
+
+def build_stat_table(items, conversion_dict, computed=()):
+    colors = ['black'] * (len(conversion_dict) + len(computed))
     stat_table = []
     for item in items:
         label = str(item.id)
         values = [str(getattr(item, attribute)) for attribute in conversion_dict.values()]
+        values += [str(column[item.id]) for column in computed]
 
         stat_table.append(ui.stat_table_item(label=label, values=values, colors=colors.copy()))
 
@@ -211,6 +313,14 @@ table_conversion_dicts = {
 }
 
 
+# Columns that are not attributes of the rows: 'Column name': function of (session, ids) giving {id: value}
+table_computed_columns = {
+    dbm.MoveRequest: {
+        'Unanswered': dbm.unanswered_quantities,
+    },
+}
+
+
 def format_table_item_move_request(item):
     quantity_ordered = int(item.values[0])
     quantity_delivered = int(item.values[1])
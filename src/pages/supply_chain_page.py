@@ -3,12 +3,12 @@ from h2o_wave import Q, ui
 from ..databasing import database_model as dbm
 from ..databasing.premade_db_content import ProductA, FakeProduct, BranchingProduct
 from ..databasing import relationship_graphing as graphing
-from .shared_content import get_selected, product_dropdown, show_table
+from .shared_content import get_selected, product_dropdown, show_table, show_card
 
 
 
 def layout(q: Q):
-    q.page['meta'] = ui.meta_card(box='', layouts=[
+    show_card(q, 'meta', ui.meta_card(box='', layouts=[
         ui.layout(
             breakpoint='xs',
             zones=[
@@ -35,30 +35,41 @@ def layout(q: Q):
 
             ]
         )
-    ])
+    ]))
 
 
-async def serve_supply_chain_page(q: Q, session):
+def serve_supply_chain_page(q: Q, session):
     if q.args.reset_db:
-        dbm.reset_and_fill_db(q.user.db_engine, session, [ProductA, FakeProduct, BranchingProduct])
+        confirm_reset(q)
+    elif q.args.confirm_reset_db:
+        # The database is shared by every client, so this resets it for all of them
+        dbm.reset_and_fill_db(q.app.db_engine, session, [ProductA, FakeProduct, BranchingProduct])
         session.commit()
         update_sc_cards(q, session)
 
     elif q.args.show_graph:
         show_graph(q, session)
+    elif q.args.table_next_page:
+        show_route_table(q, session, page=(q.client.sc_table_page or 0) + 1)
+    elif q.args.table_previous_page:
+        show_route_table(q, session, page=max(0, (q.client.sc_table_page or 0) - 1))
     else:
         update_sc_cards(q, session)
 
 
 def update_sc_cards(q: Q, session):
     show_graph(q, session)
-    show_table(q, session, dbm.SupplyRoute, box='sc_control_zone_b')
+    show_route_table(q, session, page=q.client.sc_table_page or 0)
     show_sc_controls(q, session)
 
 
+def show_route_table(q: Q, session, page):
+    q.client.sc_table_page = show_table(q, session, dbm.SupplyRoute, box='sc_control_zone_b', page=page)
+
+
 def show_sc_controls(q: Q, session):
     product_selector = product_dropdown(q, session, trigger=True)
-    q.page['sc_controls'] = ui.form_card(
+    show_card(q, 'sc_controls', ui.form_card(
         box='sc_control_zone_a',
         items=[
             ui.text_xl('Controls'),
@@ -67,19 +78,32 @@ def show_sc_controls(q: Q, session):
             ui.button(name='show_supply_routes', label='Table: Supply Routes', value='SupplyRoute'),
             ui.button(name='show_graph', label='Graph: Supply Routes'),
         ]
-    )
+    ))
+
+
+def confirm_reset(q: Q):
+    show_card(q, 'sc_controls', ui.form_card(
+        box='sc_control_zone_a',
+        items=[
+            ui.text_xl('Reset Database?'),
+            ui.message_bar(type='warning', text='This replaces all products, routes and orders for every user.'),
+            ui.buttons(items=[
+                ui.button(name='confirm_reset_db', label='Reset Database', primary=True),
+                ui.button(name='cancel_reset_db', label='Cancel'),
+            ]),
+        ]
+    ))
 
 
 def show_graph(q: Q, session):
     selected_product: dbm.Product = get_selected(q, session, dbm.Product)
-    html_content = graphing.product_to_html_str(session, selected_product)
+    html_content, width, height = graphing.product_to_html(session, selected_product)
 
-    graph_pixels = 250 +len(selected_product.supply_routes) * 50
-    q.page['graph'] = ui.form_card(
+    show_card(q, 'graph', ui.form_card(
         box='graph_zone',
         items=[
             ui.text_xl('Graph: Supply Chain for product ' + selected_product.name),
-            ui.frame(content=html_content, height=f'{str(graph_pixels)}px', width=f'{str(graph_pixels)}px')
+            ui.frame(content=html_content, height=f'{height + 20}px', width=f'{width + 20}px')
         ]
-    )
+    ))
 
@@ -1,3 +1,7 @@
+import threading
+from collections import OrderedDict
+
+import networkx as nx
 import numpy as np
 import pandas as pd
 
@@ -6,18 +10,62 @@ from matplotlib import pyplot as plt
 from .databasing.database_model import *
 
 
+bucket_sizes = {
+    'day': '1D',
+    'week': '7D',
+    'month': pd.DateOffset(months=1),
+}
+
+
+class ProjectionPeriod:
+    """ The horizon + 1 consecutive buckets (days, weeks or months) of a projection, starting on start_date. """
+    def __init__(self, start_date: date, horizon=365, bucket='day'):
+        if bucket not in bucket_sizes:
+            raise AttributeError(f'bucket must be one of {list(bucket_sizes)}')
+        if not isinstance(horizon, int) or horizon < 1:
+            raise AttributeError('horizon must be a positive integer')
+
+        self.start_date = start_date
+        self.horizon = horizon
+        self.bucket = bucket
+
+        # Each bucket starts on one of these dates, and the last one ends the day before the final edge
+        if bucket == 'month':
+            # Months are counted from start_date each time, so that the 31st is not moved to the 28th for good
+            edges = pd.DatetimeIndex([pd.Timestamp(start_date) + bucket_sizes[bucket] * i for i in range(horizon + 2)])
+        else:
+            edges = pd.date_range(start_date, periods=horizon + 2, freq=bucket_sizes[bucket])
+        self.dates_range = edges[:-1]
+        self.final_date = (edges[-1] - pd.Timedelta(days=1)).date()
+
+        edge_days = (edges - pd.Timestamp(start_date)).days.to_numpy().astype(np.int64)
+        self.first_days = edge_days[:-1]
+        self.last_days = edge_days[1:] - 1
+
+    def __len__(self):
+        return self.horizon + 1
+
+    def bucket_index(self, dates) -> np.ndarray:
+        # Bucket of each date, or -1 for dates outside the period
+        offsets = day_offsets(dates, self.start_date)
+        buckets = np.searchsorted(self.first_days, offsets, side='right') - 1
+        buckets[offsets > self.last_days[-1]] = -1
+        return buckets
+
+
 """ Parent class: """
 class StockProjection:
-    def __init__(self, session: Session, stockpoint: StockPoint, plot_period=24):
+    def __init__(self, session: Session, stockpoint: StockPoint, plot_period=24, horizon=365, bucket='day'):
 
         if not plot_period in range(3, 366):
             raise AttributeError('plot_period must be an integer between 3 and 365')
 
-        # start and end of projection
+        # start and end of projection, in horizon + 1 buckets of a day, week or month
         self.start_date = date.today()
-        self.duration = 365
-        self.final_date = self.start_date + timedelta(days=self.duration)
-        self.dates_range = pd.date_range(self.start_date, self.final_date)
+        self.period = ProjectionPeriod(self.start_date, horizon, bucket)
+        self.duration = horizon
+        self.final_date = self.period.final_date
+        self.dates_range = self.period.dates_range
 
         # basic stockpoint attributes
         self.stockpoint_id = stockpoint.id
@@ -25,11 +73,11 @@ class StockProjection:
         self.starting_stock = stockpoint.current_stock
 
         # known events in scope:
-        planned_receipts = order_filter(session, stockpoint, self.start_date, self.final_date,
-                                        incoming=True, outgoing=False, completed_or_pending='pending')
-        planned_sends = order_filter(session, stockpoint, self.start_date, self.final_date,
-                                     incoming=False, outgoing=True, completed_or_pending='pending')
-        self.included_moves = [order.__dict__ for order in planned_sends + planned_receipts]
+        planned_receipts = order_quantities(session, stockpoint, self.start_date, self.final_date,
+                                            incoming=True, outgoing=False, completed_or_pending='pending')
+        planned_sends = order_quantities(session, stockpoint, self.start_date, self.final_date,
+                                         incoming=False, outgoing=True, completed_or_pending='pending')
+        self.included_moves = moves_array(planned_receipts, planned_sends)
 
         # Main projection dataframe
         self.df = self.project_inventory(planned_receipts, planned_sends)
@@ -38,29 +86,192 @@ class StockProjection:
         return f"Inventory projection for stockpoint {self.stockpoint_id} ({self.stockpoint_name + ' for selected product'}), from {self.start_date}."
 
     def project_inventory(self, planned_receipts, planned_sends):
-        df = pd.DataFrame([[0 for col in range(2)] for row in range(self.duration + 1)], index=self.dates_range,
-                          columns=["demand", "supply"])
+        supply = quantities_per_bucket(planned_receipts, self.period)
+        demand = -quantities_per_bucket(planned_sends, self.period)
+        inventory = np.cumsum(supply) + np.cumsum(demand) + self.starting_stock
+
+        return pd.DataFrame({"demand": demand, "supply": supply, "inventory": inventory}, index=self.dates_range)
+
+    """ Incremental updates, instead of a new projection after every new or executed MoveOrder """
+
+    def is_incoming(self, order: MoveOrder):
+        return order.request.route.receiver_id == self.stockpoint_id
+
+    def moves_here(self, order: MoveOrder):
+        # Orders on routes that neither send from nor deliver to this stockpoint don't change its projection
+        route = order.request.route
+        return self.stockpoint_id in (route.sender_id, route.receiver_id)
+
+    def apply_new_order(self, order: MoveOrder):
+        # A new pending order adds to supply or demand in its bucket, and to inventory from that bucket on
+        if not self.moves_here(order):
+            return
+        bucket = self.period.bucket_index([order.order_date])[0]
+        if bucket < 0:
+            return
+        change = order.quantity if self.is_incoming(order) else -order.quantity
+        column = "supply" if self.is_incoming(order) else "demand"
+        self.change_projection(column, bucket, change, inventory_days=slice(bucket, None), inventory_change=change)
+        new_move = moves_array([order], []) if self.is_incoming(order) else moves_array([], [order])
+        self.included_moves = np.concatenate([self.included_moves, new_move])
+
+    def apply_executed_order(self, order: MoveOrder):
+        # The stock moves now: starting stock changes, and the order no longer counts as pending in its bucket
+        if not self.moves_here(order):
+            return
+        change = order.quantity if self.is_incoming(order) else -order.quantity
+        column = "supply" if self.is_incoming(order) else "demand"
+        self.starting_stock += change
+        bucket = self.period.bucket_index([order.order_date])[0]
+        if bucket >= 0:
+            self.change_projection(column, bucket, -change, inventory_days=slice(None, bucket), inventory_change=change)
+            self.included_moves = self.included_moves[self.included_moves['id'] != order.id]
+        else:
+            self.change_projection(None, bucket, 0, inventory_days=slice(None), inventory_change=change)
+
+    def change_projection(self, column, bucket, column_change, inventory_days: slice, inventory_change):
+        if column:
+            values = self.df[column].to_numpy().copy()
+            values[bucket] += column_change
+            self.df[column] = values
+
+        old_inventory = self.df["inventory"].to_numpy()
+        inventory = old_inventory.copy()
+        inventory[inventory_days] += inventory_change
+        self.df["inventory"] = inventory
+        self.update_availability(old_inventory)
+
+    def update_availability(self, old_inventory):
+        # Subclasses update the columns that derive from inventory
+        pass
+
+    def result(self):
+        return ProjectionResult(self.stockpoint_id, self.stockpoint_name, self.period, self.df, self.included_moves,
+                                description=repr(self))
+
+
+# Compact record of each pending order in a projection. Direction is 1 for receipts and -1 for sends.
+moves_dtype = np.dtype([('id', np.int64), ('order_date', 'datetime64[D]'), ('quantity', np.int64), ('direction', np.int8)])
+
+
+def moves_array(receipts, sends) -> np.ndarray:
+    orders = list(receipts) + list(sends)
+    moves = np.empty(len(orders), dtype=moves_dtype)
+    moves['id'] = [order.id for order in orders]
+    moves['order_date'] = [order.order_date for order in orders]
+    moves['quantity'] = [order.quantity for order in orders]
+    moves['direction'] = [1] * len(receipts) + [-1] * len(sends)
+    return moves
+
+
+class ProjectionResult:
+    """ The columns of a finished projection as one contiguous array, without pandas or database objects. """
+    __slots__ = ('stockpoint_id', 'stockpoint_name', 'start_date', 'horizon', 'bucket', 'columns', 'values',
+                 'included_moves', 'description')
+
+    def __init__(self, stockpoint_id, stockpoint_name, period: ProjectionPeriod, df: pd.DataFrame, included_moves,
+                 description=''):
+        self.stockpoint_id = stockpoint_id
+        self.stockpoint_name = stockpoint_name
+        # The dates are not stored: start date, horizon and bucket size rebuild them
+        self.start_date = period.start_date
+        self.horizon = period.horizon
+        self.bucket = period.bucket
+
+        # One row per column, as int32 unless the quantities need more
+        self.columns = tuple(df.columns)
+        values = df.to_numpy(dtype=np.int64).T
+        fits_int32 = values.size == 0 or (values.min() >= np.iinfo(np.int32).min and values.max() <= np.iinfo(np.int32).max)
+        self.values = np.ascontiguousarray(values, dtype=np.int32 if fits_int32 else np.int64)
+        self.included_moves = np.array(included_moves, dtype=moves_dtype)
+        self.description = description
+
+    def __repr__(self):
+        return self.description
+
+    def __len__(self):
+        return self.horizon + 1
+
+    def __getitem__(self, column: str) -> np.ndarray:
+        return self.values[self.columns.index(column)]
+
+    @property
+    def period(self):
+        return ProjectionPeriod(self.start_date, self.horizon, self.bucket)
+
+    @property
+    def final_date(self):
+        return self.period.final_date
+
+    @property
+    def dates_range(self):
+        return self.period.dates_range
+
+    def to_frame(self) -> pd.DataFrame:
+        # Same frame as the projection's df
+        return pd.DataFrame({column: self.values[i].astype(np.int64) for i, column in enumerate(self.columns)},
+                            index=self.dates_range)
+
+
+def day_offsets(dates, start_date: date) -> np.ndarray:
+    # Whole days from start_date to each date, as integers usable for indexing
+    return (np.array(dates, dtype='datetime64[D]') - np.datetime64(start_date, 'D')).astype(np.int64)
+
+
+def quantities_per_bucket(orders, period: ProjectionPeriod) -> np.ndarray:
+    # Sum of order quantities in each bucket of the period, in one pass instead of one .loc lookup per order
+    buckets = period.bucket_index([order.order_date for order in orders])
+    quantities = np.fromiter((order.quantity for order in orders), dtype=np.int64, count=len(orders))
+    in_period = buckets >= 0
+    return np.bincount(buckets[in_period], weights=quantities[in_period], minlength=len(period)).astype(np.int64)
 
-        for receipt in planned_receipts:
-            df.loc[receipt.order_date.isoformat(), ["supply"]] += receipt.quantity
-        for send in planned_sends:
-            df.loc[send.order_date.isoformat(), ["demand"]] -= send.quantity
-        inventory = np.cumsum(df["supply"]) + np.cumsum(df["demand"])
 
-        df["inventory"] = np.add(inventory, self.starting_stock)
-        return df
+def minimum_future(values) -> np.ndarray:
+    # Smallest value from each day onwards: a reversed cumulative minimum, O(n) instead of min() over every slice
+    # 2D input is treated as one series per row.
+    return np.minimum.accumulate(np.asarray(values)[..., ::-1], axis=-1)[..., ::-1]
 
 
-def minimum_future(values: list):
-    return [min(values[i:]) for i in range(len(values))]
+def update_minimum_future(minima, old_values, new_values) -> np.ndarray:
+    # minimum_future of new_values, from the minima of old_values. Days after the last day whose change differs from
+    # the final day's change all moved by the same amount, so their minima just shift. Only the days up to it are
+    # recomputed, which for one new or executed order are the days before its date.
+    minima = np.array(minima)
+    new_values = np.asarray(new_values)
+    difference = new_values - np.asarray(old_values)
+    shift = difference[-1]
+    irregular_days = np.flatnonzero(difference != shift)
+    last_irregular = irregular_days[-1] if len(irregular_days) else -1
+
+    minima[last_irregular + 1:] += shift
+    if last_irregular >= 0:
+        head = minimum_future(new_values[:last_irregular + 1])
+        if last_irregular + 1 < len(minima):
+            head = np.minimum(head, minima[last_irregular + 1])
+        minima[:last_irregular + 1] = head
+    return minima
+
+
+def purge_committed_capacity(uncommitted) -> np.ndarray:
+    # Capacity up to the last day where it is <= 0 is in fact committed to a later delivery, and is zeroed.
+    # 2D input is treated as one series per row.
+    uncommitted = np.array(uncommitted)
+    n_days = uncommitted.shape[-1]
+    committed = uncommitted <= 0
+    last_committed = np.where(committed.any(axis=-1), n_days - 1 - np.argmax(committed[..., ::-1], axis=-1), -1)
+    uncommitted[np.arange(n_days) <= last_committed[..., np.newaxis]] = 0
+    return uncommitted
 
 
 class ProjectionATP(StockProjection):
-    def __init__(self, session: Session, stockpoint: StockPoint, plot_period=24):
-        super().__init__(session, stockpoint, plot_period)
+    def __init__(self, session: Session, stockpoint: StockPoint, plot_period=24, horizon=365, bucket='day'):
+        super().__init__(session, stockpoint, plot_period, horizon, bucket)
         self.df["ATP"] = minimum_future(self.df["inventory"])
         # self.plot = self.make_plot(plot_period)
 
+    def update_availability(self, old_inventory):
+        self.df["ATP"] = update_minimum_future(self.df["ATP"], old_inventory, self.df["inventory"])
+
     def make_plot(self, duration: int):
         plot_window = self.df.loc[self.start_date:self.start_date + timedelta(days=duration)].copy()
 
@@ -93,47 +304,47 @@ class ProjectionATP(StockProjection):
 
 
 def capability_to_series(route, index):
-    return pd.Series(data=[route.capability(day) for day in range(len(index))], index=index)
+    return pd.Series(data=route.capability_curve(len(index)), index=index)
 
 
-def potential_capacity(routes: list[SupplyRoute], index) -> pd.Series:
-    columns = {str(route.id): capability_to_series(route, index) for route in routes}
-    frame = pd.DataFrame(data=columns)
-    frame['total_capacity'] = frame.sum(axis=1)
-    return frame['total_capacity']
+def potential_capacity(routes: list[SupplyRoute], index, days=None) -> pd.Series:
+    # Summed capability of all routes, computed for all of them at once. By default one day per index entry,
+    # otherwise at the given days, such as the last day of each bucket.
+    days = len(index) if days is None else days
+    curves = capability_curves([route.capacity for route in routes], [route.lead_time for route in routes], days)
+    return pd.Series(data=curves.sum(axis=0), index=index, name='total_capacity')
 
 
 class ProjectionCTP(StockProjection):
-    def __init__(self, session: Session, stockpoint: StockPoint, plot_period=24):
-        super().__init__(session, stockpoint, plot_period)
+    def __init__(self, session: Session, stockpoint: StockPoint, plot_period=24, horizon=365, bucket='day'):
+        super().__init__(session, stockpoint, plot_period, horizon, bucket)
         self.df["ATP"] = minimum_future(self.df["inventory"])
 
-        incoming_routes = get_incoming_routes(session, stockpoint)
-        if not incoming_routes:
-            self.df['CTP'] = self.df["ATP"]
-            self.df['Uncommitted capacity'] = pd.Series([0 for day in range(self.duration + 1)], index=self.dates_range)
-        else:
-            self.project_ctp(incoming_routes)
+        # Without incoming routes there is no capacity, and CTP equals ATP
+        self.project_ctp(get_incoming_routes(session, stockpoint))
 
         # self.plot = self.make_plot(plot_period)
 
+    def update_availability(self, old_inventory):
+        self.df["ATP"] = update_minimum_future(self.df["ATP"], old_inventory, self.df["inventory"])
+
+        old_potential_inventory = old_inventory + self.df['Uncommitted capacity'].to_numpy()
+        uncommitted = purge_committed_capacity(self.cum_capacity - np.cumsum(self.df['supply'].to_numpy()))
+        self.df['Uncommitted capacity'] = uncommitted
+        self.df["CTP"] = update_minimum_future(self.df["CTP"], old_potential_inventory,
+                                               self.df["inventory"].to_numpy() + uncommitted)
+
     def project_ctp(self, routes: list[SupplyRoute]):
-        self.df['cum_supply'] = np.cumsum(self.df['supply'])
-        self.df['cum_capacity'] = potential_capacity(routes, self.dates_range)
+        # Intermediate series are kept as arrays, only the results become columns
+        self.cum_capacity = potential_capacity(routes, self.dates_range, self.period.last_days).to_numpy()
+        cum_supply = np.cumsum(self.df['supply'].to_numpy())
 
-        self.df['Uncommitted capacity'] = np.subtract(self.df['cum_capacity'], self.df['cum_supply'])
         # Purge premature "unused capacity" which is in fact committed to a later delivery.
-        i = 0
-        for unused_capacity in self.df['Uncommitted capacity'][::-1]:
-            if unused_capacity <= 0:
-                self.df['Uncommitted capacity'].iloc[:self.duration - i + 1] = 0
-                break
-            i += 1
-
-        self.df["potential_inventory"] = np.add(self.df['inventory'], self.df['Uncommitted capacity'])
+        uncommitted = purge_committed_capacity(self.cum_capacity - cum_supply)
+        self.df['Uncommitted capacity'] = uncommitted
 
-        self.df["CTP"] = minimum_future(self.df["potential_inventory"])
-        self.df.drop(columns=['cum_supply', 'cum_capacity', 'potential_inventory'], inplace=True)
+        potential_inventory = self.df['inventory'].to_numpy() + uncommitted
+        self.df["CTP"] = minimum_future(potential_inventory)
 
     def make_plot(self, duration: int):
 
@@ -171,4 +382,343 @@ class ProjectionCTP(StockProjection):
             axis.set_xlabel('Day')
 
         fig.suptitle(self.__repr__(), fontsize=16)
-        return plt
\ No newline at end of file
+        return plt
+
+
+class ProjectionCache:
+    """ Least-recently-used projection results, keyed by stockpoint, date and the stockpoint's data version. """
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()  # Requests are served from worker threads
+
+    def __repr__(self):
+        return f"Projection cache with {len(self.entries)}/{self.maxsize} entries, {self.hits} hits, {self.misses} misses."
+
+    def key(self, session: Session, stockpoint: StockPoint, projection_type, horizon=365, bucket='day'):
+        # Committed writes to a stockpoint's stock, routes, requests or orders bump its data version, in its engine's
+        # versions. Their serial tells apart databases with the same url, like two in-memory ones.
+        versions = data_versions(session.get_bind())
+        return (versions.serial, projection_type, horizon, bucket, stockpoint.id, date.today(),
+                versions.get(stockpoint.id))
+
+    def get(self, session: Session, stockpoint: StockPoint, projection_type=ProjectionCTP, horizon=365,
+            bucket='day') -> ProjectionResult:
+        key = self.key(session, stockpoint, projection_type, horizon, bucket)
+        with self.lock:
+            if key in self.entries:
+                self.hits += 1
+                self.entries.move_to_end(key)
+                return self.entries[key]
+            self.misses += 1
+
+        # Projected outside the lock, so that other stockpoints are not kept waiting
+        result = projection_type(session, stockpoint, horizon=horizon, bucket=bucket).result()
+        with self.lock:
+            self.entries[key] = result
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+        return result
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+projection_cache = ProjectionCache()
+
+
+def earliest_buckets(availability, quantities, basket=False) -> np.ndarray:
+    # First bucket from which availability (ATP or CTP, never decreasing) covers each quantity, by binary search,
+    # or -1 if it is not covered within the horizon.
+    # As a basket, each quantity comes on top of the ones before it, so that all of them can be promised together.
+    quantities = np.asarray(quantities, dtype=np.int64)
+    if basket:
+        quantities = np.cumsum(quantities)
+    buckets = np.searchsorted(np.asarray(availability), quantities, side='left')
+    return np.where(buckets < len(availability), buckets, -1)
+
+
+def earliest_promise_dates(projection, quantities, column='CTP', basket=False) -> list:
+    # Earliest date on which a stockpoint can send each quantity, from its projection or cached result.
+    # A bucket's availability holds by its last day. None if not possible within the horizon.
+    availability = projection[column] if isinstance(projection, ProjectionResult) else projection.df[column]
+    buckets = earliest_buckets(availability, quantities, basket)
+    last_days = projection.period.last_days
+    return [projection.start_date + timedelta(days=int(last_days[bucket])) if bucket >= 0 else None
+            for bucket in buckets]
+
+
+def sender_availability(session: Session, routes, column='CTP') -> dict:
+    # What each route's sender can send from each day on, from its cached projection. Copies, free to reserve from.
+    availability = {}
+    for route in routes:
+        if route.sender_id not in availability:
+            result = projection_cache.get(session, route.sender, ProjectionCTP)
+            availability[route.sender_id] = result[column].astype(np.int64)
+    return availability
+
+
+def route_availability(session: Session, routes, period: ProjectionPeriod) -> dict:
+    # What each route can still deliver from each day on: its capability, less what is pending on it
+    routes = {route.id: route for route in routes}
+    n_days = len(period)
+    pending = np.zeros((len(routes), n_days), dtype=np.int64)
+    row_of_route = {route_id: row for row, route_id in enumerate(routes)}
+    for route_id, order_date, quantity in get_pending_route_moves(session, list(routes), period.start_date,
+                                                                  period.final_date):
+        pending[row_of_route[route_id], (order_date - period.start_date).days] += quantity
+    capability = capability_curves([route.capacity for route in routes.values()],
+                                   [route.lead_time for route in routes.values()], n_days)
+    availability = minimum_future(capability - np.cumsum(pending, axis=1))
+    return {route_id: availability[row] for route_id, row in row_of_route.items()}
+
+
+def quote_requests(session: Session, requests, column='CTP', basket=False) -> list:
+    # Earliest promise dates for (route, quantity) pairs: the first day that both the route's sender and the route
+    # itself can take the quantity, as RequestAllocator would confirm it. None if not possible within the horizon.
+    # One cached projection per sender, however many requests. As a basket, each request comes on top of the ones
+    # before it from the same sender or on the same route, so that all of them can be promised together.
+    period = ProjectionPeriod(date.today())
+    routes = {route for route, _ in requests}
+    senders = sender_availability(session, routes, column)
+    route_curves = route_availability(session, routes, period)
+
+    dates = []
+    for route, quantity in requests:
+        availability = np.minimum(senders[route.sender_id], route_curves[route.id])
+        day = earliest_buckets(availability, [quantity])[0]
+        dates.append(period.start_date + timedelta(days=int(day)) if day >= 0 else None)
+        if basket:
+            senders[route.sender_id] = senders[route.sender_id] - quantity
+            route_curves[route.id] = route_curves[route.id] - quantity
+    return dates
+
+
+def reserve(availability: np.ndarray, bucket, quantity):
+    # Availability (a minimum over the future) after quantity is taken in bucket: less from that bucket on, and no
+    # more than what is left there in the buckets before. Updated in place.
+    availability[bucket:] -= quantity
+    np.minimum(availability[:bucket], availability[bucket], out=availability[:bucket])
+
+
+class RequestAllocator:
+    """ Confirms MoveRequests against the CTP of their senders and the capability of their routes. """
+    def __init__(self, session: Session, routes, column='CTP'):
+        self.session = session
+        self.start_date = date.today()
+        self.period = ProjectionPeriod(self.start_date)
+        self.sender_availability = sender_availability(session, routes, column)
+        self.route_availability = route_availability(session, routes, self.period)
+
+    def allocate(self, request: MoveRequest, quantity=None) -> list[MoveOrder]:
+        # As much of the unanswered quantity as possible on the requested day (or today, if that has passed), and
+        # the rest on the first day that all of it is available. Orders are added to the session, not committed.
+        quantity = request.unanswered_quantity() if quantity is None else quantity
+        day = max((request.requested_delivery_date - self.start_date).days, 0)
+        if quantity <= 0 or day >= len(self.period):
+            return []
+        sender = self.sender_availability[request.route.sender_id]
+        route = self.route_availability[request.route_id]
+
+        orders = []
+        on_time = int(np.clip(min(sender[day], route[day]), 0, quantity))
+        if on_time:
+            orders.append(self.add_order(request, day, on_time, sender, route))
+        rest = quantity - on_time
+        if rest:
+            later_day = int(np.searchsorted(np.minimum(sender, route), rest, side='left'))
+            if later_day < len(self.period):
+                orders.append(self.add_order(request, later_day, rest, sender, route))
+        return orders
+
+    def add_order(self, request, day, quantity, sender, route) -> MoveOrder:
+        reserve(sender, day, quantity)
+        reserve(route, day, quantity)
+        order = MoveOrder(request=request, order_date=self.start_date + timedelta(days=day), quantity=quantity)
+        self.session.add(order)
+        return order
+
+
+def allocate_requests(session: Session, requests=None, column='CTP', key=None) -> dict:
+    # Confirms the requests (by default all open ones) in order of requested date and id, or of key.
+    # Returns the new MoveOrders of each request id; requests that get none are left out.
+    if requests is None:
+        open_requests = get_open_requests(session)
+    else:
+        session.flush()
+        quantities = unanswered_quantities(session, [request.id for request in requests])
+        open_requests = [(request, quantities[request.id]) for request in requests]
+    key = key or (lambda request: (request.requested_delivery_date, request.id))
+    open_requests.sort(key=lambda row: key(row[0]))
+    allocator = RequestAllocator(session, {request.route for request, _ in open_requests}, column)
+
+    allocated = {}
+    for request, quantity in open_requests:
+        orders = allocator.allocate(request, quantity)
+        if orders:
+            allocated[request.id] = orders
+    return allocated
+
+
+class ProductProjection:
+    """ Supply, demand, inventory, ATP and CTP for every stockpoint of a product, as stockpoint x day matrices. """
+    def __init__(self, session: Session, product: Product, horizon=365, bucket='day'):
+
+        # start and end of projection
+        self.start_date = date.today()
+        self.period = ProjectionPeriod(self.start_date, horizon, bucket)
+        self.duration = horizon
+        self.final_date = self.period.final_date
+        self.dates_range = self.period.dates_range
+
+        self.product_id = product.id
+        self.product_name = product.name
+
+        # One query each for stockpoints, routes and the pending moves between them
+        stockpoints = get_product_stockpoints(session, product)
+        routes = get_product_routes(session, product)
+        moves = get_pending_product_moves(session, product, self.start_date, self.final_date)
+
+        self.stockpoint_ids = [stockpoint.id for stockpoint in stockpoints]
+        self.stockpoint_names = [stockpoint.name for stockpoint in stockpoints]
+        self.row_of = {stockpoint_id: row for row, stockpoint_id in enumerate(self.stockpoint_ids)}
+        starting_stock = np.array([stockpoint.current_stock for stockpoint in stockpoints], dtype=np.int64)
+
+        self.project_inventory(moves, starting_stock)
+        self.atp = minimum_future(self.inventory)
+        self.project_ctp(routes)
+
+    def __repr__(self):
+        return f"Inventory projection for all {len(self.stockpoint_ids)} stockpoints of {self.product_name}, from {self.start_date}."
+
+    def rows(self, stockpoint_ids) -> np.ndarray:
+        return np.array([self.row_of[stockpoint_id] for stockpoint_id in stockpoint_ids], dtype=np.int64)
+
+    def per_stockpoint_and_bucket(self, rows, buckets, quantities) -> np.ndarray:
+        n_buckets = len(self.period)
+        flat_index = rows * n_buckets + buckets
+        totals = np.bincount(flat_index, weights=quantities, minlength=len(self.stockpoint_ids) * n_buckets)
+        return totals.astype(np.int64).reshape(len(self.stockpoint_ids), n_buckets)
+
+    def project_inventory(self, moves, starting_stock):
+        buckets = self.period.bucket_index([move.order_date for move in moves])
+        quantities = np.array([move.quantity for move in moves], dtype=np.int64)
+
+        receivers = self.rows([move.receiver_id for move in moves])
+        senders = self.rows([move.sender_id for move in moves])
+        self.supply = self.per_stockpoint_and_bucket(receivers, buckets, quantities)
+        self.demand = -self.per_stockpoint_and_bucket(senders, buckets, quantities)
+        self.inventory = np.cumsum(self.supply, axis=1) + np.cumsum(self.demand, axis=1) + starting_stock[:, np.newaxis]
+
+    def project_ctp(self, routes):
+        # Capability of each route by the end of each bucket, summed into the capacity of its receiver
+        route_capability = capability_curves([route.capacity for route in routes],
+                                             [route.lead_time for route in routes], self.period.last_days)
+
+        cum_capacity = np.zeros_like(self.supply)
+        np.add.at(cum_capacity, self.rows([route.receiver_id for route in routes]), route_capability)
+
+        uncommitted = purge_committed_capacity(cum_capacity - np.cumsum(self.supply, axis=1))
+        self.uncommitted_capacity = uncommitted
+        self.ctp = minimum_future(self.inventory + uncommitted)
+
+    def frame(self, stockpoint_id) -> pd.DataFrame:
+        # Same columns as ProjectionCTP.df, for one stockpoint
+        row = self.row_of[stockpoint_id]
+        return pd.DataFrame({
+            "demand": self.demand[row],
+            "supply": self.supply[row],
+            "inventory": self.inventory[row],
+            "ATP": self.atp[row],
+            "Uncommitted capacity": self.uncommitted_capacity[row],
+            "CTP": self.ctp[row],
+        }, index=self.dates_range)
+
+    def matrix(self, column: str) -> pd.DataFrame:
+        # One column for all stockpoints, with stockpoints as rows and days as columns
+        values = {
+            "demand": self.demand,
+            "supply": self.supply,
+            "inventory": self.inventory,
+            "ATP": self.atp,
+            "Uncommitted capacity": self.uncommitted_capacity,
+            "CTP": self.ctp,
+        }[column]
+        return pd.DataFrame(values, index=self.stockpoint_ids, columns=self.dates_range)
+
+
+def network_order(stockpoint_ids, routes) -> list:
+    # Senders before their receivers. Stockpoints in a cycle of routes are kept together, in id order.
+    graph = nx.DiGraph()
+    graph.add_nodes_from(stockpoint_ids)
+    graph.add_edges_from((route.sender_id, route.receiver_id) for route in routes)
+    condensed = nx.condensation(graph)
+    return [stockpoint_id for component in nx.topological_sort(condensed)
+            for stockpoint_id in sorted(condensed.nodes[component]['members'])]
+
+
+class NetworkProjection(ProductProjection):
+    """ ProductProjection where routes only add capability that their sender can fill, through the whole network. """
+
+    def project_inventory(self, moves, starting_stock):
+        super().project_inventory(moves, starting_stock)
+        self.moves = moves
+
+    def route_pending(self, routes) -> np.ndarray:
+        # Cumulative pending deliveries of each route per bucket. A route is the only one from its sender to its receiver.
+        n_buckets = len(self.period)
+        row_of_route = {(route.sender_id, route.receiver_id): row for row, route in enumerate(routes)}
+        rows = np.array([row_of_route[move.sender_id, move.receiver_id] for move in self.moves], dtype=np.int64)
+        buckets = self.period.bucket_index([move.order_date for move in self.moves])
+        quantities = np.array([move.quantity for move in self.moves], dtype=np.int64)
+        in_period = buckets >= 0
+        pending = np.bincount(rows[in_period] * n_buckets + buckets[in_period], weights=quantities[in_period],
+                              minlength=len(routes) * n_buckets).astype(np.int64).reshape(len(routes), n_buckets)
+        return np.cumsum(pending, axis=1)
+
+    def project_ctp(self, routes):
+        # Stockpoints are visited senders first, so every route is capped by its sender's final availability.
+        # Each stockpoint and route is handled once, in O(buckets).
+        routes = sorted(routes, key=lambda route: route.id)
+        lead_times = np.array([route.lead_time for route in routes], dtype=np.int64)
+        route_capability = capability_curves([route.capacity for route in routes], lead_times, self.period.last_days)
+        pending = self.route_pending(routes)
+
+        # Bucket in which deliveries that arrive by the end of each bucket leave the sender, or -1 if before today
+        ship_days = self.period.last_days - lead_times[:, np.newaxis] + 1
+        ship_buckets = np.searchsorted(self.period.first_days, ship_days, side='right') - 1
+        bucket_numbers = np.arange(len(self.period))
+
+        # Routes in a cycle whose sender comes later keep their full capability
+        capability = route_capability.copy()
+        incoming = {stockpoint_id: [] for stockpoint_id in self.stockpoint_ids}
+        outgoing = {stockpoint_id: [] for stockpoint_id in self.stockpoint_ids}
+        for i, route in enumerate(routes):
+            incoming[route.receiver_id].append(i)
+            outgoing[route.sender_id].append(i)
+
+        self.uncommitted_capacity = np.zeros_like(self.supply)
+        self.ctp = np.zeros_like(self.supply)
+        for stockpoint_id in network_order(self.stockpoint_ids, routes):
+            row = self.row_of[stockpoint_id]
+            cum_capacity = capability[incoming[stockpoint_id]].sum(axis=0)
+            self.uncommitted_capacity[row] = purge_committed_capacity(cum_capacity - np.cumsum(self.supply[row]))
+            potential_inventory = self.inventory[row] + self.uncommitted_capacity[row]
+            self.ctp[row] = minimum_future(potential_inventory)
+
+            # Routes out of this stockpoint share what it can spare, in route order: each route can deliver what is
+            # already pending on it, plus what the stockpoint can spare when the goods leave. What a route takes is
+            # reserved from the stockpoint before the next route.
+            available = self.ctp[row]
+            for i in outgoing[stockpoint_id]:
+                spare = np.where(ship_buckets[i] >= 0, np.maximum(available[ship_buckets[i]], 0), 0)
+                capability[i] = np.minimum(route_capability[i], pending[i] + spare)
+                extra = np.maximum.accumulate(np.maximum(capability[i] - pending[i], 0))
+
+                last_arrival = np.searchsorted(ship_buckets[i], bucket_numbers, side='right') - 1
+                potential_inventory = potential_inventory - np.where(last_arrival >= 0, extra[last_arrival], 0)
+                available = minimum_future(potential_inventory)
+
@@ -0,0 +1,510 @@
+import sys
+import time
+import asyncio
+import copy
+import json
+import tempfile
+import tracemalloc
+from types import SimpleNamespace
+from random import randint
+
+import networkx as nx
+import numpy as np
+import pandas as pd
+from sqlalchemy import insert
+from sqlalchemy.pool import StaticPool
+
+from ..databasing.database_model import *
+from ..databasing.premade_db_content import ProductA, BranchingProduct
+from ..databasing.relationship_graphing import layered_layout, graph_to_net, net_to_html_str
+from ..projection import StockProjection, ProjectionCTP, ProductProjection, ProjectionPeriod, ProjectionResult, \
+    NetworkProjection, earliest_promise_dates, allocate_requests
+from ..pages.inventory_page import plot_payload, plotable_columns, data
+from ..web_app import serve_ctp, serve_request
+from ..projection import projection_cache
+from h2o_wave import Q, Expando
+from h2o_wave.core import AsyncPage
+
+"""
+    Benchmarks for the hot paths of the app. Run from the repository root with:
+    python -m src.sandbox.benchmarks <benchmark name>
+    Without a name, all benchmarks are run.
+"""
+
+
+def timed(func, *args, repeats=3, **kwargs):
+    # Best of a few runs, in seconds
+    best = float('inf')
+    for _ in range(repeats):
+        start = time.perf_counter()
+        func(*args, **kwargs)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def fake_projection_frame(duration=365, starting_stock=100):
+    start_date = date.today()
+    return SimpleNamespace(start_date=start_date, duration=duration, starting_stock=starting_stock,
+                           period=ProjectionPeriod(start_date, duration),
+                           dates_range=pd.date_range(start_date, start_date + timedelta(days=duration)))
+
+
+def fake_orders(n, duration=365):
+    return [SimpleNamespace(order_date=date.today() + timedelta(days=randint(0, duration)), quantity=randint(1, 100))
+            for _ in range(n)]
+
+
+def loop_project_inventory(projection, planned_receipts, planned_sends):
+    # The original implementation: one label lookup per order
+    df = pd.DataFrame([[0 for col in range(2)] for row in range(projection.duration + 1)],
+                      index=projection.dates_range, columns=["demand", "supply"])
+    for receipt in planned_receipts:
+        df.loc[receipt.order_date.isoformat(), ["supply"]] += receipt.quantity
+    for send in planned_sends:
+        df.loc[send.order_date.isoformat(), ["demand"]] -= send.quantity
+    inventory = np.cumsum(df["supply"]) + np.cumsum(df["demand"])
+    df["inventory"] = np.add(inventory, projection.starting_stock)
+    return df
+
+
+def bench_project_inventory(order_counts=(100, 1_000, 10_000)):
+    projection = fake_projection_frame()
+    print('project_inventory, orders per second:')
+    for n in order_counts:
+        receipts, sends = fake_orders(n // 2), fake_orders(n // 2)
+        loop_time = timed(loop_project_inventory, projection, receipts, sends, repeats=1)
+        vector_time = timed(StockProjection.project_inventory, projection, receipts, sends)
+        print(f'{n:>8} orders | loop: {n / loop_time:>12,.0f}/s | bincount: {n / vector_time:>12,.0f}/s '
+              f'| speedup {loop_time / vector_time:,.1f}x')
+
+
+def bench_product_projection(orders_per_route=1_000):
+    engine = create_engine("sqlite+pysqlite:///:memory:", echo=False, future=True)
+    reset_db(engine)
+    with Session(engine) as session:
+        add_from_class(session, BranchingProduct)
+        for route in get_all(session, SupplyRoute):
+            request = MoveRequest(route=route, date_of_registration=date.today(),
+                                  requested_delivery_date=date.today(), quantity=0)
+            request.move_orders = [MoveOrder(quantity=randint(1, 10), order_date=date.today() + timedelta(days=randint(0, 365)))
+                                   for _ in range(orders_per_route)]
+            session.add(request)
+        session.commit()
+
+        product = get_all(session, Product)[0]
+        stockpoints = list(product.stock_points)
+        single_time = timed(lambda: [ProjectionCTP(session, stockpoint) for stockpoint in stockpoints])
+        batch_time = timed(ProductProjection, session, product)
+    print(f'{len(stockpoints)} stockpoints, {orders_per_route} orders per route | one ProjectionCTP each: '
+          f'{single_time * 1000:,.1f} ms | ProductProjection: {batch_time * 1000:,.1f} ms')
+
+
+def seed_move_orders(engine, n_orders, chunk_size=50_000):
+    # ProductA and BranchingProduct, plus n_orders single-order requests spread over the routes and +-1 year from today
+    reset_db(engine)
+    with Session(engine) as session:
+        add_from_class(session, ProductA)
+        add_from_class(session, BranchingProduct)
+        session.execute(update(StockPoint).values(current_stock=10**9))
+        session.commit()
+        route_ids = [route.id for route in get_all(session, SupplyRoute)]
+
+        today = date.today()
+        for first_id in range(1, n_orders + 1, chunk_size):
+            ids = range(first_id, min(first_id + chunk_size, n_orders + 1))
+            days = [randint(-365, 365) for _ in ids]
+            quantities = [randint(1, 100) for _ in ids]
+            session.execute(insert(MoveRequest), [
+                {'id': 1000 + i, 'route_id': route_ids[i % len(route_ids)], 'quantity': quantity,
+                 'date_of_registration': today, 'requested_delivery_date': today + timedelta(days=day)}
+                for i, day, quantity in zip(ids, days, quantities)
+            ])
+            session.execute(insert(MoveOrder), [
+                {'request_id': 1000 + i, 'quantity': quantity, 'order_date': today + timedelta(days=day),
+                 'completion_status': int(day < 0)}
+                for i, day, quantity in zip(ids, days, quantities)
+            ])
+        session.commit()
+
+
+def time_hot_queries(engine):
+    with Session(engine) as session:
+        stockpoint = get_all_by_name(session, StockPoint, "Finished goods")[0]
+        results = {
+            'get_scheduled_orders': timed(get_scheduled_orders, session, date.today()),
+            'order_quantities (pending, 1 year)': timed(
+                order_quantities, session, stockpoint, date.today(), date.today() + timedelta(days=365),
+                incoming=True, outgoing=True, completed_or_pending='pending'),
+            'ProjectionCTP': timed(ProjectionCTP, session, stockpoint),
+            'execute_scheduled (1 day)': timed(lambda: (execute_scheduled(session, date.today()), session.rollback())),
+        }
+    return results
+
+
+def bench_indexes(n_orders=1_000_000):
+    engine = create_engine("sqlite+pysqlite:///:memory:", echo=False, future=True)
+    seed_move_orders(engine, n_orders)
+    indexes = [index for table in Base.metadata.sorted_tables for index in table.indexes]
+
+    for index in indexes:
+        index.drop(engine)
+    before = time_hot_queries(engine)
+
+    for index in indexes:
+        index.create(engine)
+    with engine.begin() as connection:
+        connection.exec_driver_sql("ANALYZE")
+    after = time_hot_queries(engine)
+
+    print(f'Query latency with {n_orders:,} MoveOrders, without -> with indexes:')
+    for name in before:
+        print(f'{name:>36}: {before[name] * 1000:>10,.1f} ms -> {after[name] * 1000:>8,.1f} ms')
+
+
+def bench_execute_range(n_orders=100_000, days=30):
+    engine = create_engine("sqlite+pysqlite:///:memory:", echo=False, future=True)
+    seed_move_orders(engine, n_orders)
+    end_date = date.today() + timedelta(days=days - 1)
+
+    def execute_day_by_day(session):
+        for day in pd.date_range(date.today(), end_date).date:
+            execute_scheduled(session, day)
+
+    with Session(engine) as session:
+        loop_time = timed(lambda: (execute_day_by_day(session), session.rollback()), repeats=1)
+        bulk_time = timed(lambda: (execute_scheduled_range(session, date.today(), end_date), session.rollback()), repeats=1)
+        n_executed = len(execute_scheduled_range(session, date.today(), end_date)[0])
+    print(f'Executing {n_executed:,} orders over {days} days | execute_scheduled per day: {loop_time:,.2f} s '
+          f'| execute_scheduled_range: {bulk_time:,.2f} s')
+
+
+def traced_memory(build):
+    # Bytes still allocated after build(), with what it returned kept alive
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    kept = build()
+    allocated = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    del kept
+    return allocated
+
+
+def bench_cached_projections(n_projections=10_000, n_orders=2_000):
+    # Memory of n_projections cached projections, as full ProjectionCTP objects or as ProjectionResults.
+    # Copies of one projection per stockpoint stand in for the projections of many stockpoints and days.
+    engine = create_engine("sqlite+pysqlite:///:memory:", echo=False, future=True)
+    seed_move_orders(engine, n_orders)
+    with Session(engine) as session:
+        projections = [ProjectionCTP(session, stockpoint) for stockpoint in get_all(session, StockPoint)]
+    n_moves = sum(len(projection.included_moves) for projection in projections) / len(projections)
+
+    def full_projections():
+        return [copy.deepcopy(projections[i % len(projections)]) for i in range(n_projections)]
+
+    def results():
+        return [projections[i % len(projections)].result() for i in range(n_projections)]
+
+    full_size, result_size = traced_memory(full_projections), traced_memory(results)
+    print(f'{n_projections:,} cached projections, {n_moves:,.0f} pending orders each on average | '
+          f'ProjectionCTP: {full_size / 2**20:,.1f} MiB | ProjectionResult: {result_size / 2**20:,.1f} MiB '
+          f'| {full_size / result_size:,.1f}x smaller')
+
+
+def frame_plot_payload(projection: ProjectionResult, selected_columns, plot_period):
+    # The original show_plot: a frame slice, per-row date strings and a mixed-type row list
+    projection_frame = projection.to_frame()
+    plot_frame = projection_frame.loc[projection_frame.index[:plot_period], selected_columns].copy()
+    y_min = min(0, int(plot_frame.to_numpy().min() * 1.1))
+    y_max = max(20, int(plot_frame.to_numpy().max() * 1.1))
+    date_strings = [date.isoformat() for date in projection.dates_range[:plot_period]]
+    plot_frame['date'] = [date_string[:10] for date_string in date_strings]
+    return data(fields=plot_frame.columns.tolist(), rows=plot_frame.values.tolist()), y_min, y_max
+
+
+def bench_plot_payload(plot_period=365):
+    engine = create_engine("sqlite+pysqlite:///:memory:", echo=False, future=True)
+    seed_move_orders(engine, 2_000)
+    with Session(engine) as session:
+        stockpoint = get_all_by_name(session, StockPoint, "Finished goods")[0]
+        result = ProjectionCTP(session, stockpoint).result()
+
+    frame_data = frame_plot_payload(result, plotable_columns, plot_period)[0]
+    packed_data = plot_payload(result, plotable_columns, plot_period)[0]
+    frame_size = len(json.dumps(frame_data.dump(), separators=(',', ':')))
+    packed_size = len(json.dumps(packed_data, separators=(',', ':')))
+
+    frame_time = timed(frame_plot_payload, result, plotable_columns, plot_period, repeats=20)
+    packed_time = timed(plot_payload, result, plotable_columns, plot_period, repeats=20)
+    print(f'Plot payload for {plot_period} days x {len(plotable_columns)} columns | '
+          f'frame rows: {frame_time * 1000:,.2f} ms, {frame_size / 1024:,.1f} KiB | '
+          f'packed columns: {packed_time * 1000:,.2f} ms, {packed_size / 1024:,.1f} KiB')
+
+
+class NullSite:
+    # Stands in for the Wave server, which is not needed to measure what would be sent to it. Records the size of
+    # what q.page.save() sends, through the site interface of the pinned Wave version.
+    def __init__(self):
+        self.bytes_sent = 0
+
+    def __getitem__(self, url):
+        return AsyncPage(self, url)
+
+    async def _save(self, url, changes):
+        self.bytes_sent += len(changes.encode())
+
+
+def bench_page_updates(n_orders=2_000):
+    # Bytes sent to the Wave server per interaction, with card changes only, or with every card sent whole as before.
+    # Requests are served from worker threads, which share the one in-memory database through a StaticPool.
+    engine = create_engine("sqlite+pysqlite:///:memory:", echo=False, future=True, poolclass=StaticPool,
+                           connect_args={'check_same_thread': False})
+    seed_move_orders(engine, n_orders)
+    interactions = [
+        ('open inventories', {'#': 'inventory_page'}),
+        ('plot length slider', {'#': 'inventory_page', 'plot_length': 13}),
+        ('plot length slider', {'#': 'inventory_page', 'plot_length': 14}),
+        ('fewer plot columns', {'#': 'inventory_page', 'plot_columns': ['inventory', 'CTP']}),
+        ('refresh plot', {'#': 'inventory_page', 'refresh_plot_button': True}),
+        ('other stockpoint', {'#': 'inventory_page', 'stockpoint_selection': 3}),
+        ('open supply chain', {'#': 'sc_page'}),
+        ('show graph', {'#': 'sc_page', 'show_graph': True}),
+        ('other product', {'#': 'sc_page', 'product_selection': 2}),
+        ('back to inventories', {'#': 'inventory_page'}),
+    ]
+
+    async def run(whole_cards):
+        app_state = Expando(dict(initialized=True, db_engine=engine))
+        client_state = Expando()
+        bytes_sent = []
+        for _, args in interactions:
+            site = NullSite()
+            q = Q(site, 'unicast', None, 'bench', '/', app_state, Expando(), client_state, Expando(args), Expando(), {})
+            if whole_cards and client_state.initialized:
+                client_state.shown_cards = {}
+            await serve_ctp(q)
+            bytes_sent.append(site.bytes_sent)
+        return bytes_sent
+
+    whole, changes = asyncio.run(run(whole_cards=True)), asyncio.run(run(whole_cards=False))
+    print('Bytes sent per interaction, every card whole -> card changes only:')
+    for (name, _), whole_size, change_size in zip(interactions, whole, changes):
+        print(f'{name:>24}: {whole_size:>9,} -> {change_size:>9,}')
+    print(f'{"total":>24}: {sum(whole):>9,} -> {sum(changes):>9,}')
+
+
+def layered_network(n_layers, stockpoints_per_layer, senders_per_stockpoint=2):
+    # A multi-echelon supply network: every stockpoint receives from a few stockpoints of the layer before
+    graph = nx.DiGraph()
+    layers = np.arange(n_layers * stockpoints_per_layer).reshape(n_layers, stockpoints_per_layer).tolist()
+    for layer in layers:
+        graph.add_nodes_from((node, {'label': f'Stockpoint {node}'}) for node in layer)
+    for senders, receivers in zip(layers, layers[1:]):
+        for receiver in receivers:
+            for sender in np.random.choice(senders, senders_per_stockpoint, replace=False).tolist():
+                graph.add_edge(sender, receiver, label=f'Route {sender}-{receiver}')
+    return graph
+
+
+def bench_graph_layout(sizes=((4, 5), (10, 20), (20, 50))):
+    print('Server-side graph layout and rendering:')
+    for n_layers, stockpoints_per_layer in sizes:
+        graph = layered_network(n_layers, stockpoints_per_layer)
+        layout_time = timed(layered_layout, graph)
+        layout = layered_layout(graph)
+        render_time = timed(lambda: net_to_html_str(graph_to_net(graph, layout)))
+        print(f'{len(graph.nodes):>6} stockpoints, {len(graph.edges):>6} routes | layout: {layout_time * 1000:>8,.1f} ms '
+              f'| pyvis HTML: {render_time * 1000:>8,.1f} ms')
+
+
+def bench_concurrency(client_counts=(1, 4, 16), requests_per_client=5, interval=1.0, n_orders=5_000):
+    # Response times of simultaneous clients, with the database work on the event loop as before, or in worker
+    # threads. Every interval, even clients open an inventory projection, computed anew, and odd clients the supply
+    # chain graph, served from cache. Response times count from when a request was due, so that time spent waiting
+    # for a blocked event loop is included.
+    def client_args(client_id, request):
+        if client_id % 2:
+            return {'#': 'sc_page', 'show_graph': True}
+        return {'#': 'inventory_page', 'stockpoint_selection': 1 + (client_id + request) % 10}
+
+    async def on_event_loop(q):
+        serve_request(q)
+        await q.page.save()
+
+    async def client(engine, handler, client_id, start, response_times):
+        app_state = Expando(dict(initialized=True, db_engine=engine))
+        client_state = Expando()
+
+        def query(args):
+            return Q(NullSite(), 'unicast', None, f'client{client_id}', '/', app_state, Expando(), client_state,
+                     Expando(args), Expando(), {})
+
+        await serve_ctp(query(client_args(client_id, 0)))
+        for request in range(requests_per_client):
+            due = start + interval * (request + client_id / len(response_times))
+            await asyncio.sleep(max(0.0, due - time.perf_counter()))
+            await handler(query(client_args(client_id, request)))
+            response_times[client_id].append(time.perf_counter() - due)
+
+    async def run(engine, handler, n_clients):
+        response_times = [[] for _ in range(n_clients)]
+        start = time.perf_counter() + interval
+        await asyncio.gather(*[client(engine, handler, client_id, start, response_times)
+                               for client_id in range(n_clients)])
+        graph_times = [times for client_id, times in enumerate(response_times) if client_id % 2]
+        return (np.percentile(np.concatenate(response_times), [50, 99]) * 1000,
+                np.percentile(np.concatenate(graph_times or [[np.nan]]), [50, 99]) * 1000)
+
+    maxsize, projection_cache.maxsize = projection_cache.maxsize, 0
+    with tempfile.TemporaryDirectory() as directory:
+        engine = create_app_engine(f"sqlite+pysqlite:///{directory}/benchmark.db")
+        seed_move_orders(engine, n_orders)
+        print(f'Response times with {n_orders:,} MoveOrders, p50 / p99 in ms, all requests (graph requests):')
+        for n_clients in client_counts:
+            for name, handler in [('event loop', on_event_loop), ('worker threads', serve_ctp)]:
+                (p50, p99), (graph_p50, graph_p99) = asyncio.run(run(engine, handler, n_clients))
+                print(f'{n_clients:>4} clients, {name:>14}: {p50:>7,.1f} / {p99:>7,.1f} '
+                      f'({graph_p50:>7,.1f} / {graph_p99:>7,.1f})')
+        engine.dispose()
+    projection_cache.maxsize = maxsize
+
+
+def bench_network_projection(sizes=((4, 5), (10, 20), (20, 50)), orders_per_route=20):
+    # NetworkProjection against ProductProjection, for layered networks of growing size
+    print('Projection of all stockpoints of a product:')
+    for n_layers, stockpoints_per_layer in sizes:
+        engine = create_engine("sqlite+pysqlite:///:memory:", echo=False, future=True)
+        reset_db(engine)
+        graph = layered_network(n_layers, stockpoints_per_layer)
+        with Session(engine) as session:
+            product = Product(name='Network', price=10)
+            stockpoints = {node: StockPoint(product=product, name=f'Stockpoint {node}', current_stock=randint(0, 500))
+                           for node in graph.nodes}
+            for sender, receiver in graph.edges:
+                route = SupplyRoute(product=product, sender=stockpoints[sender], receiver=stockpoints[receiver],
+                                    capacity=randint(5, 50), lead_time=randint(1, 10))
+                request = MoveRequest(route=route, date_of_registration=date.today(),
+                                      requested_delivery_date=date.today(), quantity=0)
+                request.move_orders = [MoveOrder(quantity=randint(1, 10),
+                                                 order_date=date.today() + timedelta(days=randint(0, 365)))
+                                       for _ in range(orders_per_route)]
+            session.add(product)
+            session.commit()
+
+            product_time = timed(ProductProjection, session, product)
+            network_time = timed(NetworkProjection, session, product)
+        print(f'{len(graph.nodes):>6} stockpoints, {len(graph.edges):>6} routes | ProductProjection: '
+              f'{product_time * 1000:>8,.1f} ms | NetworkProjection: {network_time * 1000:>8,.1f} ms')
+
+
+def bench_promise_dates(n_quotes=(10, 1_000, 100_000)):
+    # Batch binary search against scanning the CTP column for the first day that covers each quantity
+    engine = create_engine("sqlite+pysqlite:///:memory:", echo=False, future=True)
+    seed_move_orders(engine, 2_000)
+    with Session(engine) as session:
+        result = ProjectionCTP(session, get_all_by_name(session, StockPoint, "Finished goods")[0]).result()
+    ctp = result['CTP'].tolist()
+
+    def scan(quantities):
+        return [next((day for day, value in enumerate(ctp) if value >= quantity), None) for quantity in quantities]
+
+    print('Earliest promise dates, quotes per second:')
+    for n in n_quotes:
+        quantities = np.random.randint(min(ctp), max(ctp) + 1, size=n)
+        scan_time = timed(scan, quantities, repeats=1)
+        search_time = timed(earliest_promise_dates, result, quantities)
+        print(f'{n:>8} quotes | scan: {n / scan_time:>12,.0f}/s | binary search: {n / search_time:>12,.0f}/s')
+
+
+def bench_allocate(n_requests=10_000, n_reprojected=100):
+    # One batch with incremental availability, against re-projecting the sender and route before every request
+    engine = create_engine("sqlite+pysqlite:///:memory:", echo=False, future=True)
+    seed_move_orders(engine, 2_000)
+    with Session(engine) as session:
+        route_ids = [route.id for route in get_all(session, SupplyRoute)]
+        today = date.today()
+        session.execute(insert(MoveRequest), [
+            {'id': 10**6 + i, 'route_id': route_ids[i % len(route_ids)], 'quantity': randint(1, 100),
+             'date_of_registration': today, 'requested_delivery_date': today + timedelta(days=randint(0, 90))}
+            for i in range(n_requests)
+        ])
+        session.commit()
+
+    print('Allocating unanswered requests against CTP:')
+    with Session(engine) as session:
+        start = time.perf_counter()
+        allocated = allocate_requests(session)
+        batch_time = time.perf_counter() - start
+        n_orders = sum(len(orders) for orders in allocated.values())
+        session.rollback()
+    print(f'batch: {n_requests / batch_time:>10,.0f} requests/s ({n_orders} orders for {len(allocated)} requests)')
+
+    maxsize, projection_cache.maxsize = projection_cache.maxsize, 0
+    with Session(engine) as session:
+        requests = [request for request, _ in get_open_requests(session)[:n_reprojected]]
+        start = time.perf_counter()
+        for request in requests:
+            allocate_requests(session, [request])
+            session.flush()
+        reproject_time = time.perf_counter() - start
+        session.rollback()
+    projection_cache.maxsize = maxsize
+    print(f'reprojecting each: {n_reprojected / reproject_time:>10,.0f} requests/s')
+
+
+def bench_open_requests(n_requests=50_000):
+    # A route's open requests with their unanswered quantities: one grouped query against loading each one's orders
+    engine = create_engine("sqlite+pysqlite:///:memory:", echo=False, future=True)
+    seed_move_orders(engine, 0)
+    with Session(engine) as session:
+        route = get_all(session, SupplyRoute)[0]
+        today = date.today()
+        session.execute(insert(MoveRequest), [
+            {'id': 10**6 + i, 'route_id': route.id, 'quantity': 100, 'date_of_registration': today,
+             'requested_delivery_date': today + timedelta(days=i % 365)}
+            for i in range(n_requests)
+        ])
+        session.execute(insert(MoveOrder), [
+            {'request_id': 10**6 + i, 'quantity': 50 * (i % 3), 'order_date': today + timedelta(days=i % 365)}
+            for i in range(n_requests)
+        ])
+        session.commit()
+        route_id = route.id
+
+    def per_request():
+        with Session(engine) as session, QueryCounter(engine) as counter:
+            requests = get_by_id(session, SupplyRoute, route_id).move_requests
+            rows = [(request, request.unanswered_quantity()) for request in requests]
+            return [row for row in rows if row[1] > 0], counter.count
+
+    def grouped():
+        with Session(engine) as session, QueryCounter(engine) as counter:
+            return get_open_requests(session, get_by_id(session, SupplyRoute, route_id)), counter.count
+
+    print(f'Open requests on a route with {n_requests} requests:')
+    for name, func in [('per request', per_request), ('grouped query', grouped)]:
+        start = time.perf_counter()
+        rows, n_queries = func()
+        print(f'{name:>13}: {time.perf_counter() - start:>6.2f} s | {n_queries:>6} queries | {len(rows)} open')
+
+
+benchmarks = {
+    'project_inventory': bench_project_inventory,
+    'product_projection': bench_product_projection,
+    'indexes': bench_indexes,
+    'execute_range': bench_execute_range,
+    'cached_projections': bench_cached_projections,
+    'plot_payload': bench_plot_payload,
+    'page_updates': bench_page_updates,
+    'graph_layout': bench_graph_layout,
+    'concurrency': bench_concurrency,
+    'network_projection': bench_network_projection,
+    'promise_dates': bench_promise_dates,
+    'allocate': bench_allocate,
+    'open_requests': bench_open_requests,
+}
+
+
+if __name__ == "__main__":
+    selected = sys.argv[1:] or list(benchmarks)
+    for name in selected:
+        benchmarks[name]()
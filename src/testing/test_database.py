@@ -1,8 +1,20 @@
 from sqlalchemy import inspect
+from sqlalchemy.dialects import postgresql, mysql
 import pytest
 
 from ..databasing.database_model import *
 from ..databasing.premade_db_content import ProductA, FakeProduct, BranchingProduct
+from ..databasing.bulk_content import generate_network
+from ..pages.shared_content import table_of_children, table_conversion_dicts, show_card, remove_card, rebuild_page, \
+    table_page_size
+from ..pages import supply_chain_page, order_page
+from .. import web_app
+
+import json
+from types import SimpleNamespace
+from concurrent.futures import ThreadPoolExecutor
+from h2o_wave import ui, Expando
+from h2o_wave.core import PageBase
 
 
 def capture_sql_exception(func, *args, **kwargs):
@@ -104,6 +116,12 @@ class TestQueryFilters:
                 assert set(outgoing_orders) <= set(all_orders)
                 assert set(incoming_orders).isdisjoint(set(outgoing_orders))
 
+                # Without date bounds, the filter covers all of the stockpoint's orders
+                assert order_filter(test_session, stockpoint, None, None, incoming=True, outgoing=False,
+                                    completed_or_pending='pending') == uncompleted_orders(incoming_orders)
+                assert order_filter(test_session, stockpoint, None, None, incoming=False, outgoing=True,
+                                    completed_or_pending='pending') == uncompleted_orders(outgoing_orders)
+
                 early_dates = [date.today(), date.today() + timedelta(days=5), date.today() + timedelta(days=30)]
                 later_dates = [date.today() + timedelta(days=5), date.today() + timedelta(days=15),
                                date.today() + timedelta(days=100)]
@@ -127,13 +145,47 @@ class TestQueryFilters:
                         assert set(incoming_these_dates) <= set(incoming_orders)
                         assert set(outgoing_these_dates) <= set(outgoing_orders)
                         assert set(all_orders_these_dates) <= set(all_orders)
-                        assert set(all_orders_these_dates) == set(incoming_these_dates + outgoing_these_dates)
+                        assert all_orders_these_dates == incoming_these_dates + outgoing_these_dates
 
                         # assert consistent result between single-step and two-step filtering
                         assert incoming_these_dates == filter_by_date(incoming_orders, start_date, end_date)
                         assert outgoing_these_dates == filter_by_date(outgoing_orders, start_date, end_date)
+
+                        # SQL-side status filtering matches filtering the ORM lists, also as lightweight rows
+                        pending_incoming = order_filter(test_session, stockpoint, start_date, end_date,
+                                                        incoming=True, outgoing=False, completed_or_pending='pending')
+                        completed_outgoing = order_filter(test_session, stockpoint, start_date, end_date,
+                                                          incoming=False, outgoing=True, completed_or_pending='completed')
+                        assert pending_incoming == uncompleted_orders(incoming_these_dates)
+                        assert completed_outgoing == completed_orders(outgoing_these_dates)
+
+                        pending_rows = order_quantities(test_session, stockpoint, start_date, end_date,
+                                                        incoming=True, outgoing=False, completed_or_pending='pending')
+                        assert [tuple(row) for row in pending_rows] == \
+                               [(order.id, order.request_id, order.order_date, order.quantity) for order in pending_incoming]
             # Does not commit
 
+    def test_incoming_before_outgoing(self):
+        with Session(test_engine) as test_session:
+            reset_and_fill_db(test_engine, test_session, [ProductA])
+            upstream, downstream = get_all(test_session, SupplyRoute)[:2]
+            stockpoint = upstream.receiver
+            assert downstream.sender == stockpoint
+
+            # The outgoing order is created first, so has the lower id
+            for route in [downstream, upstream]:
+                add_request(test_session, route, date.today() + timedelta(days=50), 5)
+                fill_request(test_session, route.move_requests[-1])
+            test_session.flush()
+
+            day = date.today() + timedelta(days=50)
+            incoming = order_filter(test_session, stockpoint, day, day, incoming=True, outgoing=False)
+            outgoing = order_filter(test_session, stockpoint, day, day, incoming=False, outgoing=True)
+            assert outgoing[0].id < incoming[0].id
+            assert order_filter(test_session, stockpoint, day, day, incoming=True, outgoing=True) == incoming + outgoing
+
+        reset_db(test_engine)
+
 
 class TestMoveExecution:
     def test_execute_moves(self):
@@ -254,6 +306,195 @@ class TestAddItems:
             assert guard_clause_triggered
 
 
+class TestBulkExecution:
+    def snapshot(self, session):
+        return ({sp.id: sp.current_stock for sp in get_all(session, StockPoint)},
+                {order.id: order.completion_status for order in get_all(session, MoveOrder)},
+                {request.id: request.quantity_delivered for request in get_all(session, MoveRequest)})
+
+    def test_execute_scheduled_range(self):
+        start_date, end_date = date.today(), date.today() + timedelta(days=10)
+        with Session(test_engine) as session:
+            reset_and_fill_db(test_engine, session, [ProductA, FakeProduct, BranchingProduct])
+            # One order too big for any sender
+            add_request(session, get_all(session, SupplyRoute)[0], date.today() + timedelta(days=1), 10**6)
+            fill_request(session, get_all(session, MoveRequest)[-1])
+            session.commit()
+
+            # Expected result: execute_move on each order in date order, skipping the invalid ones
+            expected_rejected = []
+            stmt = select(MoveOrder).where(MoveOrder.completion_status == 0). \
+                where(MoveOrder.order_date.between(start_date, end_date)).order_by(MoveOrder.order_date, MoveOrder.id)
+            for order in session.scalars(stmt).all():
+                try:
+                    execute_move(session, order)
+                except ValueError:
+                    expected_rejected.append(order.id)
+            expected_state = self.snapshot(session)
+            session.rollback()
+
+            executed, rejected = execute_scheduled_range(session, start_date, end_date, chunk_size=3)
+            assert [order_id for order_id, reason in rejected] == expected_rejected
+            assert get_all(session, MoveOrder)[-1].id in expected_rejected
+            assert self.snapshot(session) == expected_state
+            session.commit()
+
+        with Session(test_engine) as session:
+            assert self.snapshot(session) == expected_state
+            # Executed orders are not executed again. Rejected ones may pass now that later receipts are in stock.
+            executed_again, rejected_again = execute_scheduled_range(session, start_date, end_date)
+            assert set(executed_again).isdisjoint(executed)
+            assert set(executed_again) | {order_id for order_id, reason in rejected_again} == \
+                   {order_id for order_id, reason in rejected}
+            with pytest.raises(ValueError):
+                execute_scheduled_range(session, end_date, start_date)
+
+        reset_db(test_engine)
+
+
+class TestEagerLoading:
+    def render_route_orders(self, route_id):
+        # Queries used to build a route's MoveOrder table
+        with Session(test_engine) as session, QueryCounter(test_engine) as counter:
+            route = get_by_id(session, SupplyRoute, route_id)
+            table = table_of_children(None, session, MoveOrder, table_conversion_dicts[MoveOrder], route)
+        return counter.count, len(table)
+
+    def test_constant_query_count(self):
+        with Session(test_engine) as session:
+            reset_and_fill_db(test_engine, session, [ProductA, BranchingProduct])
+            session.commit()
+            route_id = get_all(session, SupplyRoute)[0].id
+
+        queries_before, rows_before = self.render_route_orders(route_id)
+
+        with Session(test_engine) as session:
+            route = get_by_id(session, SupplyRoute, route_id)
+            for day in range(30):
+                add_request(session, route, date.today() + timedelta(days=day), 5)
+                fill_request(session, route.move_requests[-1])
+            session.commit()
+
+        queries_after, rows_after = self.render_route_orders(route_id)
+        assert rows_after == rows_before + 30
+        assert queries_after == queries_before
+
+        # Scheduled orders come with their requests, routes and stockpoints
+        with Session(test_engine) as session, QueryCounter(test_engine) as counter:
+            orders = get_scheduled_orders(session, date.today())
+            [repr(order) for order in orders]
+        assert orders and counter.count == 1
+
+        reset_db(test_engine)
+
+
+class TestOpenRequests:
+    def test_unanswered_quantities(self):
+        with Session(test_engine) as session:
+            reset_and_fill_db(test_engine, session, [ProductA, BranchingProduct])
+            route = get_all(session, SupplyRoute)[0]
+            for quantity, answered in [(50, 0), (50, 20), (50, 50), (50, 70)]:
+                add_request(session, route, date.today() + timedelta(days=3), quantity)
+                if answered:
+                    session.add(MoveOrder(request=route.move_requests[-1], order_date=date.today(), quantity=answered))
+            session.commit()
+
+        with Session(test_engine) as session:
+            requests = get_all(session, MoveRequest)
+            expected = {request.id: request.unanswered_quantity() for request in requests}
+
+            # One query each, whatever the number of requests and orders
+            with QueryCounter(test_engine) as counter:
+                quantities = unanswered_quantities(session, list(expected))
+                open_requests = get_open_requests(session)
+                [repr(request) for request, _ in open_requests]
+            assert counter.count == 2
+            assert quantities == expected
+            assert [(request.id, quantity) for request, quantity in open_requests] == \
+                   [(request_id, quantity) for request_id, quantity in expected.items() if quantity > 0]
+
+            route = get_all(session, SupplyRoute)[0]
+            assert [quantity for _, quantity in get_open_requests(session, route)][-2:] == [50, 30]
+
+            # The request table of the Orders page shows them too, with one query for the whole page
+            with QueryCounter(test_engine) as counter:
+                table = table_of_children(None, session, MoveRequest, table_conversion_dicts[MoveRequest], route)
+            assert counter.count == 2
+            assert [item.values[-1] for item in table][-4:] == ['50', '30', '0', '-20']
+
+        # Only the subquery groups, so the eagerly loaded route columns are valid on other databases too
+        for dialect in [postgresql.dialect(), mysql.dialect()]:
+            sql = str(open_requests_stmt().compile(dialect=dialect))
+            assert sql.count('GROUP BY') == 1 and 'GROUP BY move_order.request_id' in sql
+
+        reset_db(test_engine)
+
+
+class TestChildQueries:
+    def test_children_and_pages(self):
+        with Session(test_engine) as session:
+            reset_and_fill_db(test_engine, session, [ProductA, FakeProduct, BranchingProduct])
+            session.commit()
+
+            for product in get_all(session, Product):
+                assert get_children(session, StockPoint, product) == product.stock_points
+                assert get_children(session, SupplyRoute, product) == product.supply_routes
+
+            for route in get_all(session, SupplyRoute):
+                expected_orders = [order for order in get_all(session, MoveOrder) if order.request.route == route]
+                assert get_children(session, MoveOrder, route) == expected_orders
+                assert get_children(session, MoveRequest, route) == route.move_requests
+                assert count_children(session, MoveOrder, route) == len(expected_orders)
+
+                # Pages of two rows cover all children, in order and without overlap
+                pages = [get_children(session, MoveOrder, route, limit=2, offset=offset)
+                         for offset in range(0, len(expected_orders) + 2, 2)]
+                assert [order for page in pages for order in page] == expected_orders
+                assert all(len(page) <= 2 for page in pages)
+
+            assert count_children(session, MoveRequest) == len(get_all(session, MoveRequest))
+            with pytest.raises(ValueError):
+                get_children(session, Product, get_all(session, Product)[0])
+
+        reset_db(test_engine)
+
+
+class TestBulkContent:
+    def test_generate_network(self):
+        with Session(test_engine) as session:
+            reset_and_fill_db(test_engine, session, [ProductA])
+            session.commit()
+            n_premade_routes = len(get_all(session, SupplyRoute))
+
+            rows = generate_network(session, 3, 5, 2_000, chunk_size=300)
+            session.commit()
+            # Chains of 5 stockpoints, with a branch into each stockpoint after the second
+            assert rows == {'product_base': 3, 'stock_point': 15, 'supply_route': 21, 'move_request': 2_000,
+                            'move_order': 2_000}
+            assert len(get_all(session, SupplyRoute)) == n_premade_routes + 21
+
+            for route in get_all(session, SupplyRoute)[n_premade_routes:]:
+                assert route.sender.product_id == route.receiver.product_id == route.product_id
+                assert route.sender_id < route.receiver_id
+
+            # Every request is answered by its order, which is completed if it is overdue
+            assert get_open_requests(session) == []
+            for request in get_all(session, MoveRequest)[-100:]:
+                order, = request.move_orders
+                assert order.order_date == request.requested_delivery_date >= request.date_of_registration
+                assert order.completion_status == (order.order_date < date.today())
+                assert request.quantity_delivered == request.quantity * order.completion_status
+
+            # More networks are added after the ones already there
+            generate_network(session, 1, 2, 10)
+            session.commit()
+            assert len(get_all(session, Product)) == 5
+
+            with pytest.raises(ValueError):
+                generate_network(session, 1, 1, 10)
+
+        reset_db(test_engine)
+
 
 class TestOther:
     def test_capability(self):
@@ -273,4 +514,184 @@ class TestOther:
                 deliverable = route.capability(arg)
                 assert isinstance(deliverable, int) and deliverable >= 0
 
+            # The vectorized curve matches capability() day by day
+            curve = route.capability_curve(100)
+            assert curve.tolist() == [route.capability(day) for day in range(100)]
+
+        routes = get_all(test_session, SupplyRoute)
+        curves = capability_curves([route.capacity for route in routes], [route.lead_time for route in routes], 100)
+        assert curves.shape == (len(routes), 100)
+        for route, curve in zip(routes, curves):
+            assert (curve == route.capability_curve(100)).all()
+        assert capability_curves([], [], 10).shape == (0, 10)
+
+        reset_db(test_engine)
+
+
+class TestAppEngine:
+    def test_persistent_engine(self, tmp_path):
+        url = f"sqlite+pysqlite:///{tmp_path / 'ctp_test.db'}"
+        engine = create_app_engine(url)
+        fill_db_if_empty(engine, [ProductA, BranchingProduct])
+        fill_db_if_empty(engine, [ProductA, BranchingProduct])  # Already filled: adds nothing
+
+        with engine.connect() as connection:
+            assert connection.exec_driver_sql("PRAGMA journal_mode").scalar() == "wal"
+        with Session(engine) as session:
+            product_names = [product.name for product in get_all(session, Product)]
+        assert product_names == ["Product A", "Product B"]
+        engine.dispose()
+
+        # Data survives a new engine, as after a restart
+        restarted_engine = create_app_engine(url)
+        fill_db_if_empty(restarted_engine, [FakeProduct])
+        with Session(restarted_engine) as session:
+            assert [product.name for product in get_all(session, Product)] == product_names
+        restarted_engine.dispose()
+
+    def test_concurrent_sessions(self, tmp_path):
+        # Requests are served from worker threads, each with its own session on the shared engine
+        engine = create_app_engine(f"sqlite+pysqlite:///{tmp_path / 'ctp_test.db'}")
+        fill_db_if_empty(engine, [ProductA])
+        with Session(engine) as session:
+            route = get_all(session, SupplyRoute)[0]
+            route_id, receiver_id, n_requests = route.id, route.receiver_id, len(route.move_requests)
+        version = data_versions(engine).get(receiver_id)[1]
+
+        def add_and_commit(day):
+            with Session(engine) as thread_session:
+                add_request(thread_session, get_by_id(thread_session, SupplyRoute, route_id),
+                            date.today() + timedelta(days=day), 1)
+                thread_session.commit()
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            list(executor.map(add_and_commit, range(40)))
+
+        # No commit is lost, and none of their version bumps either
+        assert data_versions(engine).get(receiver_id)[1] == version + 40
+        with Session(engine) as session:
+            assert len(get_by_id(session, SupplyRoute, route_id).move_requests) == n_requests + 40
+        engine.dispose()
+
+    def test_one_connection_per_request(self, tmp_path):
+        # A request that needed a second pooled connection would time out here, with room for only one
+        engine = create_engine(f"sqlite+pysqlite:///{tmp_path / 'ctp_test.db'}", pool_size=1, max_overflow=0,
+                               pool_timeout=1)
+        fill_db_if_empty(engine, [ProductA])
+        client = Expando(dict(shown_cards={}, product_selection=1, stockpoint_selection=2, supply_route_selection=1,
+                              plot_length=12, plot_columns=['inventory', 'CTP']))
+        for page_hash in ['inventory_page', 'sc_page']:
+            q = SimpleNamespace(page=PageBase('/test'), client=client, app=Expando(dict(db_engine=engine)),
+                                args=Expando({'#': page_hash}))
+            web_app.serve_request(q)
+            assert 'header' in client.shown_cards
+        engine.dispose()
+
+
+class TestCardUpdates:
+    def test_only_changes_are_sent(self):
+        q = SimpleNamespace(page=PageBase('/test'), client=Expando(dict(shown_cards={})))
+
+        def sent_ops():
+            changes = q.page._diff()
+            return json.loads(changes)['d'] if changes else []
+
+        def stats(value, box='zone_a'):
+            return ui.tall_stats_card(box=box, items=[ui.stat(label='Stockpoint', value='Finished goods'),
+                                                      ui.stat(label='Current Stock', value=value)])
+
+        # New cards are sent whole, unchanged ones not at all
+        show_card(q, 'status', stats('10'))
+        assert [op['k'] for op in sent_ops()] == ['status']
+        whole_card = q.client.bytes_sent
+        show_card(q, 'status', stats('10'))
+        assert sent_ops() == []
+        assert q.client.bytes_sent == whole_card
+
+        # A changed field is sent alone, and counts for less than the whole card
+        show_card(q, 'status', stats('20'))
+        ops = sent_ops()
+        assert len(ops) == 1 and ops[0]['v'] == '20' and ops[0]['k'].split()[-1] == 'value'
+        assert 0 < q.client.bytes_sent - whole_card < whole_card
+
+        # Moved cards, other card types and the meta card are sent whole
+        show_card(q, 'status', stats('20', box='zone_b'))
+        show_card(q, 'status', ui.markdown_card(box='zone_b', title='Status', content='20'))
+        show_card(q, 'meta', ui.meta_card(box='', title='Before'))
+        show_card(q, 'meta', ui.meta_card(box='', title='After'))
+        assert [(op['k'], 'd' in op) for op in sent_ops()] == [('status', True), ('status', True), ('meta', True),
+                                                               ('meta', True)]
+
+        # Removed cards are deleted once, and sent whole when shown again
+        remove_card(q, 'status')
+        remove_card(q, 'status')
+        assert sent_ops() == [{'k': 'status'}]
+        show_card(q, 'status', stats('20'))
+        assert [op['k'] for op in sent_ops()] == ['status']
+
+        # A rebuilt page is deleted, and its cards are sent whole again
+        rebuild_page(q)
+        show_card(q, 'status', stats('20'))
+        ops = sent_ops()
+        assert ops[0] == {} and [op['k'] for op in ops[1:]] == ['status']
+
+
+class TestTablePages:
+    def test_table_pages(self):
+        with Session(test_engine) as session:
+            reset_and_fill_db(test_engine, session, [ProductA])
+            generate_network(session, 1, 40, 60)
+            session.commit()
+            q = SimpleNamespace(page=PageBase('/test'), client=Expando(dict(shown_cards={})), args=Expando())
+            n_routes = count_children(session, SupplyRoute)
+            assert n_routes > table_page_size
+
+            def shown_page():
+                return q.client.shown_cards['db_table']['title']
+
+            # The Supply Chain page turns its own pages, and stops at the last one
+            for expected_page in [1, 1]:
+                q.args = Expando(dict(table_next_page=True))
+                supply_chain_page.serve_supply_chain_page(q, session)
+                assert q.client.sc_table_page == expected_page
+                assert shown_page().endswith(f'{table_page_size + 1}-{n_routes} of {n_routes}')
+            q.args = Expando(dict(table_previous_page=True))
+            supply_chain_page.serve_supply_chain_page(q, session)
+            assert q.client.sc_table_page == 0
+
+            # The Orders page starts from the first page of a newly selected route
+            first_route, second_route = get_all(session, SupplyRoute)[:2]
+            q.client.supply_route_selection = first_route.id
+            order_page.show_route_table(q, session, MoveOrder, page=3)
+            assert q.client.route_table_page == 0
+            q.client.supply_route_selection = second_route.id
+            q.client.route_table_page = 5
+            q.args = Expando(dict(table_next_page=True))
+            order_page.serve_order_page(q, session)
+            assert q.client.route_table_page == 0
+
+        reset_db(test_engine)
+
+
+class TestResetConfirmation:
+    def test_reset_needs_confirmation(self):
+        with Session(test_engine) as session:
+            reset_and_fill_db(test_engine, session, [ProductA])
+            add_request(session, get_all(session, SupplyRoute)[0], date.today(), 5)
+            session.commit()
+            n_requests = len(get_all(session, MoveRequest))
+
+            q = SimpleNamespace(page=PageBase('/test'), client=Expando(dict(shown_cards={}, product_selection=1)),
+                                app=Expando(dict(db_engine=test_engine)), args=Expando(dict(reset_db=True)))
+
+            # The shared database is only reset once the user confirms
+            supply_chain_page.serve_supply_chain_page(q, session)
+            assert len(get_all(session, MoveRequest)) == n_requests
+            assert 'confirm_reset_db' in json.dumps(q.client.shown_cards['sc_controls'])
+
+            q.args = Expando(dict(confirm_reset_db=True))
+            supply_chain_page.serve_supply_chain_page(q, session)
+            assert len(get_all(session, Product)) == 3
+            assert 'confirm_reset_db' not in json.dumps(q.client.shown_cards['sc_controls'])
+
         reset_db(test_engine)
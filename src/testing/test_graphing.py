@@ -43,3 +43,55 @@ def test_html_result():
             # product_to_html_str() does all the above in one function
             assert product_to_html_str(test_session, product) == html_string
 
+
+def test_html_cache(tmp_path, monkeypatch):
+    # Rendering leaves nothing in the working directory
+    monkeypatch.chdir(tmp_path)
+    html_cache.clear()
+
+    with dbm.Session(dbm.test_engine) as test_session:
+        product = dbm.get_all(test_session, dbm.Product)[0]
+        html_string = product_to_html_str(test_session, product)
+        assert list(tmp_path.iterdir()) == []
+
+        # Unchanged topologies are served from the cache
+        assert product_to_html_str(test_session, product) is html_string
+        assert len(html_cache) == 1
+
+        # A renamed stockpoint or a new route gives a new graph
+        product.stock_points[0].name = 'Renamed'
+        renamed_html = product_to_html_str(test_session, product)
+        assert renamed_html != html_string and 'Renamed' in renamed_html
+
+        sender, receiver = product.stock_points[-1], product.stock_points[0]
+        route = dbm.SupplyRoute(product=product, sender=sender, receiver=receiver, capacity=1, lead_time=1)
+        test_session.add(route)
+        test_session.flush()
+        assert product_to_html_str(test_session, product) not in [html_string, renamed_html]
+        assert len(html_cache) == 3
+        test_session.rollback()
+
+
+def test_layered_layout():
+    with dbm.Session(dbm.test_engine) as test_session:
+        for product in dbm.get_all(test_session, dbm.Product):
+            graph = product_to_graph(test_session, product)
+            layout = layered_layout(graph)
+
+            # Every stockpoint has its own position, and routes go from left to right
+            assert set(layout) == set(graph.nodes)
+            assert len(set(layout.values())) == len(layout)
+            if nx.is_directed_acyclic_graph(graph):
+                assert all(layout[sender][0] < layout[receiver][0] for sender, receiver in graph.edges)
+
+            # The positions are fixed in the rendered network, on a canvas that fits them
+            net = graph_to_net(graph, layout)
+            assert all((node['x'], node['y']) == layout[node['id']] and not node['physics'] for node in net.nodes)
+            width, height = canvas_size(layout)
+            assert net.width == f'{width}px' and net.height == f'{height}px'
+            assert product_to_html(test_session, product)[1:] == (width, height)
+
+    # Routes in a cycle share a layer
+    cyclic = nx.DiGraph([(1, 2), (2, 3), (3, 1), (3, 4), (0, 4)])
+    assert graph_layers(cyclic) == [[0, 1, 2, 3], [4]]
+    assert layered_layout(cyclic)[4][0] > max(layered_layout(cyclic)[node][0] for node in [0, 1, 2, 3])
@@ -1,5 +1,11 @@
-from ..databasing.premade_db_content import ProductA, FakeProduct
+from ..databasing.premade_db_content import ProductA, FakeProduct, BranchingProduct
 from ..projection import *
+from ..pages.inventory_page import plot_payload, plotable_columns
+
+import json
+import timeit
+from types import SimpleNamespace
+from random import randint
 
 import pytest
 from sqlalchemy.orm import exc
@@ -67,6 +73,26 @@ class TestStockProjection:
                 projection = StockProjection(test_session, stockpoint)
                 universal_projection_assertions(test_session, projection)
 
+    def test_vectorized_inventory(self):
+        # bincount projection gives the same frame as adding the orders one by one with .loc
+        start_date = date.today()
+        frame = SimpleNamespace(start_date=start_date, duration=365, starting_stock=50, period=ProjectionPeriod(start_date),
+                                dates_range=pd.date_range(start_date, start_date + timedelta(days=365)))
+        receipts, sends = [[SimpleNamespace(order_date=start_date + timedelta(days=randint(0, 365)),
+                                            quantity=randint(-10, 100)) for _ in range(200)] for _ in range(2)]
+
+        expected = pd.DataFrame(0, index=frame.dates_range, columns=["demand", "supply"])
+        for receipt in receipts:
+            expected.loc[receipt.order_date.isoformat(), ["supply"]] += receipt.quantity
+        for send in sends:
+            expected.loc[send.order_date.isoformat(), ["demand"]] -= send.quantity
+        expected["inventory"] = np.cumsum(expected["supply"]) + np.cumsum(expected["demand"]) + frame.starting_stock
+
+        assert StockProjection.project_inventory(frame, receipts, sends).equals(expected)
+        no_orders = StockProjection.project_inventory(frame, [], [])
+        assert (no_orders["inventory"] == frame.starting_stock).all()
+        assert not no_orders[["demand", "supply"]].any().any()
+
 
 class TestATP:
     def test_atp(self):
@@ -81,6 +107,17 @@ class TestATP:
                 assert strictly_increasing(projection.df['ATP'])
 
 
+    def test_minimum_future(self):
+        # Same result as the quadratic definition, on random series of different lengths and signs
+        rng = np.random.default_rng()
+        for length in [1, 2, 30, 366, 1000]:
+            values = rng.integers(-500, 500, size=length)
+            expected = [min(values[i:]) for i in range(len(values))]
+            assert minimum_future(values).tolist() == expected
+            assert minimum_future(pd.Series(values)).tolist() == expected
+            assert minimum_future(list(values)).tolist() == expected
+
+
 class TestCTP:
     def test_determined_ctp_projections(self):
         # Known stockpoints
@@ -100,6 +137,27 @@ class TestCTP:
             out_routes = get_outgoing_routes(ctp_session2, sp_2)
         """
 
+    def test_vectorized_purge(self):
+        # Same result as the reversed loop it replaced, and a microbenchmark of the two
+        def loop_purge(values):
+            values = pd.Series(values)
+            i = 0
+            for unused_capacity in values[::-1]:
+                if unused_capacity <= 0:
+                    values.iloc[:len(values) - i] = 0
+                    break
+                i += 1
+            return values.to_numpy()
+
+        rng = np.random.default_rng()
+        series = [rng.integers(low, 500, size=366) for low in [-500, -5, 1]] + [np.arange(-10, 356)]
+        for values in series:
+            assert (purge_committed_capacity(values) == loop_purge(values)).all()
+
+        loop_time = timeit.timeit(lambda: [loop_purge(values) for values in series], number=20)
+        vector_time = timeit.timeit(lambda: [purge_committed_capacity(values) for values in series], number=20)
+        print(f'Purge of {len(series)} x 366 days: loop {loop_time * 50:.2f} ms, vectorized {vector_time * 50:.2f} ms')
+
     def test_randomised_projections(self):
         with Session(test_engine) as ctp_session_random:
             faked_product = get_by_id(ctp_session_random, Product, 2)
@@ -124,3 +182,474 @@ class TestCTP:
                 assert strictly_increasing(ctp_column)
 
         reset_db(test_engine)
+
+
+class TestProductProjection:
+    def test_matches_single_projections(self):
+        with Session(test_engine) as init_session:
+            reset_and_fill_db(test_engine, init_session, [ProductA, FakeProduct, BranchingProduct])
+            init_session.commit()
+
+        with Session(test_engine) as test_session:
+            for product in get_all(test_session, Product):
+                product_projection = ProductProjection(test_session, product)
+                assert product_projection.stockpoint_ids == [stockpoint.id for stockpoint in product.stock_points]
+
+                for stockpoint in product.stock_points:
+                    single = ProjectionCTP(test_session, stockpoint)
+                    batched = product_projection.frame(stockpoint.id)
+                    for column in single.df.columns:
+                        assert batched[column].equals(single.df[column]), column
+
+                ctp_matrix = product_projection.matrix('CTP')
+                assert ctp_matrix.shape == (len(product.stock_points), product_projection.duration + 1)
+                assert (ctp_matrix.to_numpy() >= product_projection.matrix('ATP').to_numpy()).all()
+
+        reset_db(test_engine)
+
+
+class TestProjectionPeriods:
+    def test_buckets(self):
+        with pytest.raises(AttributeError):
+            ProjectionPeriod(date.today(), bucket='fortnight')
+        with pytest.raises(AttributeError):
+            ProjectionPeriod(date.today(), horizon=0)
+
+        period = ProjectionPeriod(date(2024, 1, 31), horizon=12, bucket='month')
+        assert len(period) == len(period.dates_range) == 13
+        assert [day.day for day in period.dates_range[:3]] == [31, 29, 31]
+        assert period.final_date == date(2025, 2, 27)
+        assert (period.first_days[1:] == period.last_days[:-1] + 1).all()
+        assert period.bucket_index([date(2024, 1, 30), date(2024, 1, 31), date(2024, 2, 29), date(2025, 2, 28)]).tolist() == \
+               [-1, 0, 1, -1]
+
+    def test_weekly_matches_daily(self):
+        with Session(test_engine) as init_session:
+            reset_and_fill_db(test_engine, init_session, [ProductA, BranchingProduct])
+            init_session.commit()
+
+        with Session(test_engine) as test_session:
+            for stockpoint in get_all(test_session, StockPoint):
+                weekly = ProjectionCTP(test_session, stockpoint, horizon=156, bucket='week')
+                assert len(weekly.df) == 157 and weekly.final_date == date.today() + timedelta(weeks=157, days=-1)
+
+                # Inside the first year, weekly buckets hold the daily quantities, and end on the daily inventory
+                daily = ProjectionCTP(test_session, stockpoint, horizon=52 * 7 - 1)
+                weeks = np.arange(52 * 7) // 7
+                for column in ['supply', 'demand']:
+                    assert (np.bincount(weeks, weights=daily.df[column]) == weekly.df[column][:52]).all()
+                assert (daily.df['inventory'].to_numpy()[6::7] == weekly.df['inventory'][:52]).all()
+
+                assert (weekly.df['CTP'] >= weekly.df['ATP']).all()
+                assert strictly_increasing(weekly.df['CTP'])
+
+                short = ProjectionATP(test_session, stockpoint, horizon=20)
+                assert len(short.df) == 21 and short.final_date == date.today() + timedelta(days=20)
+
+            for product in get_all(test_session, Product):
+                product_projection = ProductProjection(test_session, product, horizon=24, bucket='month')
+                for stockpoint in product.stock_points:
+                    single = ProjectionCTP(test_session, stockpoint, horizon=24, bucket='month')
+                    for column in single.df.columns:
+                        assert product_projection.frame(stockpoint.id)[column].equals(single.df[column])
+
+        reset_db(test_engine)
+
+
+class TestNetworkProjection:
+    def test_premade_networks(self):
+        with Session(test_engine) as init_session:
+            reset_and_fill_db(test_engine, init_session, [ProductA, BranchingProduct])
+            init_session.commit()
+
+        with Session(test_engine) as test_session:
+            for product in get_all(test_session, Product):
+                network = NetworkProjection(test_session, product)
+                direct = ProductProjection(test_session, product)
+
+                # Upstream limits can only lower CTP, never below ATP
+                assert (network.atp <= network.ctp).all() and (network.ctp <= direct.ctp).all()
+                assert (np.diff(network.ctp, axis=1) >= 0).all()
+                for stockpoint in product.stock_points:
+                    if not get_incoming_routes(test_session, stockpoint):
+                        assert network.frame(stockpoint.id).equals(direct.frame(stockpoint.id))
+
+            # With plenty of stock everywhere, routes are only limited by their own capability
+            test_session.execute(update(StockPoint).values(current_stock=10**9))
+            for product in get_all(test_session, Product):
+                assert NetworkProjection(test_session, product).matrix('CTP').equals(
+                    ProductProjection(test_session, product).matrix('CTP'))
+            test_session.rollback()
+
+        reset_db(test_engine)
+
+    def test_chain(self):
+        # Source (5 in stock) -> Middle -> End, and Source -> Sibling. Middle's route comes first, and takes all 5.
+        reset_db(test_engine)
+        with Session(test_engine) as test_session:
+            product = Product(name='Chain', price=10)
+            source, middle, end, sibling = [StockPoint(product=product, name=name, current_stock=stock)
+                                            for name, stock in [('Source', 5), ('Middle', 0), ('End', 0), ('Sibling', 0)]]
+            for sender, receiver, lead_time in [(source, middle, 1), (middle, end, 2), (source, sibling, 1)]:
+                test_session.add(SupplyRoute(product=product, sender=sender, receiver=receiver, capacity=10,
+                                             lead_time=lead_time))
+            test_session.add(product)
+            test_session.commit()
+
+            network = NetworkProjection(test_session, product, horizon=10)
+            ctp = {stockpoint.name: network.ctp[network.row_of[stockpoint.id]].tolist()
+                   for stockpoint in [source, middle, end, sibling]}
+            assert ctp == {'Source': [5] * 11, 'Middle': [0] + [5] * 10, 'End': [0, 0] + [5] * 9, 'Sibling': [0] * 11}
+            assert ProductProjection(test_session, product, horizon=10).ctp[network.row_of[end.id], -1] == 90
+
+        reset_db(test_engine)
+
+
+class TestPromiseDates:
+    def test_earliest_dates(self):
+        with Session(test_engine) as init_session:
+            reset_and_fill_db(test_engine, init_session, [ProductA, BranchingProduct])
+            init_session.commit()
+
+        def first_covering_day(values, quantity):
+            return next((i for i, value in enumerate(values) if value >= quantity), None)
+
+        rng = np.random.default_rng()
+        with Session(test_engine) as test_session:
+            for stockpoint in get_all(test_session, StockPoint):
+                projection = ProjectionCTP(test_session, stockpoint)
+                result = projection.result()
+                for column in ['ATP', 'CTP']:
+                    values = projection.df[column].tolist()
+                    quantities = rng.integers(min(values) - 10, max(values) + 10, size=100)
+                    expected = [None if day is None else date.today() + timedelta(days=day)
+                                for day in [first_covering_day(values, quantity) for quantity in quantities]]
+                    assert earliest_promise_dates(projection, quantities, column) == expected
+                    assert earliest_promise_dates(result, quantities, column) == expected
+
+                    # As a basket, each quantity is promised on top of the ones before
+                    basket = earliest_promise_dates(result, [5, 10, 0, 20], column, basket=True)
+                    assert basket == earliest_promise_dates(result, [5, 15, 15, 35], column)
+
+                # In weekly buckets, quantities are promised by the end of the first week that covers them
+                weekly = ProjectionCTP(test_session, stockpoint, horizon=52, bucket='week')
+                week = first_covering_day(weekly.df['CTP'].tolist(), 50)
+                expected = None if week is None else date.today() + timedelta(days=7 * week + 6)
+                assert earliest_promise_dates(weekly, [50]) == [expected]
+
+            # Requests are quoted from what both their sender and their route can take, as the allocator sees it
+            routes = get_all(test_session, SupplyRoute)
+            allocator = RequestAllocator(test_session, routes)
+            requests = [(routes[i % len(routes)], 20 * i) for i in range(30)]
+            quoted = quote_requests(test_session, requests)
+            for (route, quantity), promise_date in zip(requests, quoted):
+                curve = np.minimum(allocator.sender_availability[route.sender_id],
+                                   allocator.route_availability[route.id]).tolist()
+                day = first_covering_day(curve, quantity)
+                assert promise_date == (None if day is None else date.today() + timedelta(days=day))
+
+                # Never earlier than the sender alone could send it, nor before the route's lead time is up
+                sender_date, = earliest_promise_dates(ProjectionCTP(test_session, route.sender), [quantity])
+                if promise_date is not None:
+                    assert sender_date is not None and promise_date >= sender_date
+                    assert quantity == 0 or promise_date >= date.today() + timedelta(days=route.lead_time - 1)
+
+            # As a basket, each request comes on top of the ones before it
+            same_route = [(routes[0], 30), (routes[0], 40)]
+            assert quote_requests(test_session, same_route, 'ATP', basket=True)[1] == \
+                   quote_requests(test_session, [(routes[0], 70)], 'ATP')[0]
+
+        reset_db(test_engine)
+
+
+class TestAllocation:
+    def test_allocate_requests(self):
+        with Session(test_engine) as init_session:
+            reset_and_fill_db(test_engine, init_session, [ProductA, BranchingProduct])
+            init_session.commit()
+
+        rng = np.random.default_rng()
+        with Session(test_engine) as test_session:
+            routes = get_all(test_session, SupplyRoute)
+            for i in range(60):
+                add_request(test_session, routes[i % len(routes)],
+                            date.today() + timedelta(days=int(rng.integers(-5, 60))), int(rng.integers(1, 200)))
+            test_session.commit()
+
+            requests = [request for request, _ in get_open_requests(test_session)]
+            assert len(requests) >= 60
+
+            # Each request gets at most two orders: what fits on the requested day, and the rest when it fits
+            allocator = RequestAllocator(test_session, routes)
+            initial_routes = {route_id: curve.copy() for route_id, curve in allocator.route_availability.items()}
+            receivers = set()
+            for request in sorted(requests, key=lambda request: (request.requested_delivery_date, request.id)):
+                unanswered = request.unanswered_quantity()
+                orders = allocator.allocate(request)
+                assert len(orders) <= 2
+                assert sum(order.quantity for order in orders) <= unanswered
+                assert all(order.quantity > 0 for order in orders)
+                if orders:
+                    receivers.add(request.route.receiver_id)
+                    assert orders[0].order_date >= max(request.requested_delivery_date, date.today())
+                    assert orders[-1].order_date >= orders[0].order_date
+                if len(orders) == 2:
+                    assert request.unanswered_quantity() == 0
+            test_session.commit()
+
+            # The incremental curves match the ones from the new orders
+            rebuilt = RequestAllocator(test_session, routes)
+            for route_id, curve in allocator.route_availability.items():
+                assert curve.tolist() == rebuilt.route_availability[route_id].tolist()
+                assert curve.min() >= min(initial_routes[route_id].min(), 0)
+            for sender_id, curve in allocator.sender_availability.items():
+                if sender_id not in receivers:
+                    assert curve.tolist() == rebuilt.sender_availability[sender_id].tolist()
+
+            # A second pass only allocates what is still unanswered
+            for request_id, orders in allocate_requests(test_session).items():
+                request = get_by_id(test_session, MoveRequest, request_id)
+                assert request.unanswered_quantity() >= 0 and len(orders) <= 2
+            test_session.rollback()
+
+        reset_db(test_engine)
+
+
+class TestIncrementalProjection:
+    def test_update_minimum_future(self):
+        rng = np.random.default_rng()
+        for _ in range(50):
+            old_values = rng.integers(-100, 100, size=40)
+            new_values = old_values.copy()
+            day = rng.integers(0, 40)
+            new_values[day:] += rng.integers(-50, 50)  # A new order on day
+            new_values[:rng.integers(0, 40)] += rng.integers(-50, 50)  # An executed order
+            updated = update_minimum_future(minimum_future(old_values), old_values, new_values)
+            assert updated.tolist() == minimum_future(new_values).tolist()
+
+    def test_matches_full_rebuild(self):
+        with Session(test_engine) as init_session:
+            reset_and_fill_db(test_engine, init_session, [ProductA, BranchingProduct])
+            init_session.commit()
+
+        with Session(test_engine) as test_session:
+            for route in get_all(test_session, SupplyRoute):
+                projections = [projection_type(test_session, stockpoint)
+                               for projection_type in [StockProjection, ProjectionATP, ProjectionCTP]
+                               for stockpoint in [route.sender, route.receiver]]
+
+                # New orders, inside and outside the projection period
+                for days_ahead in [400, 365, -2, 3, 0]:
+                    add_request(test_session, route, date.today() + timedelta(days=days_ahead), 10)
+                    fill_request(test_session, route.move_requests[-1])
+                    test_session.flush()
+                    for projection in projections:
+                        projection.apply_new_order(route.move_requests[-1].move_orders[-1])
+
+                # Executed orders, including one overdue
+                for request in route.move_requests[-3:]:
+                    order = request.move_orders[-1]
+                    execute_move(test_session, order)
+                    test_session.flush()
+                    for projection in projections:
+                        projection.apply_executed_order(order)
+
+                for projection in projections:
+                    rebuilt = type(projection)(test_session, get_by_id(test_session, StockPoint, projection.stockpoint_id))
+                    assert projection.df.equals(rebuilt.df)
+                    assert projection.starting_stock == rebuilt.starting_stock
+                    assert sorted(move['id'] for move in projection.included_moves) == \
+                           sorted(move['id'] for move in rebuilt.included_moves)
+            test_session.rollback()
+
+        reset_db(test_engine)
+
+    def test_ignores_other_routes(self):
+        with Session(test_engine) as init_session:
+            reset_and_fill_db(test_engine, init_session, [ProductA, BranchingProduct])
+            init_session.commit()
+
+        with Session(test_engine) as test_session:
+            routes = get_all(test_session, SupplyRoute)
+            for route in routes:
+                # Stockpoints that neither send nor receive on this route
+                others = {stockpoint for other in routes for stockpoint in [other.sender, other.receiver]} - \
+                         {route.sender, route.receiver}
+                projections = [projection_type(test_session, stockpoint)
+                               for projection_type in [StockProjection, ProjectionATP, ProjectionCTP]
+                               for stockpoint in others]
+                before = [(projection.df.copy(), projection.starting_stock) for projection in projections]
+
+                add_request(test_session, route, date.today() + timedelta(days=3), 10)
+                fill_request(test_session, route.move_requests[-1])
+                order = route.move_requests[-1].move_orders[-1]
+                test_session.flush()
+                for projection in projections:
+                    projection.apply_new_order(order)
+                execute_move(test_session, order)
+                test_session.flush()
+                for projection in projections:
+                    projection.apply_executed_order(order)
+
+                for projection, (df, starting_stock) in zip(projections, before):
+                    assert projection.df.equals(df)
+                    assert projection.starting_stock == starting_stock
+            test_session.rollback()
+
+        reset_db(test_engine)
+
+
+class TestProjectionCache:
+    def test_hits_and_invalidation(self):
+        with Session(test_engine) as init_session:
+            reset_and_fill_db(test_engine, init_session, [ProductA])
+            init_session.commit()
+
+        with Session(test_engine) as test_session:
+            route = get_all(test_session, SupplyRoute)[0]
+            sender, receiver = route.sender, route.receiver
+
+            # Each horizon and bucket size is its own entry
+            cache = ProjectionCache()
+            daily = cache.get(test_session, receiver)
+            weekly = cache.get(test_session, receiver, horizon=52, bucket='week')
+            assert weekly is not daily and len(weekly) == len(weekly.to_frame()) == 53
+            assert cache.get(test_session, receiver, horizon=52, bucket='week') is weekly
+            assert (cache.hits, cache.misses) == (1, 2)
+
+            cache = ProjectionCache(maxsize=2)
+            first = cache.get(test_session, receiver)
+            assert cache.get(test_session, receiver) is first
+            assert (cache.hits, cache.misses) == (1, 1)
+
+            # Uncommitted or rolled back writes do not invalidate
+            add_request(test_session, route, date.today() + timedelta(days=3), 20)
+            assert cache.get(test_session, receiver) is first
+            test_session.rollback()
+            assert cache.get(test_session, receiver) is first
+
+            # Committed writes invalidate both ends of the route, and the new projection sees them
+            add_request(test_session, route, date.today() + timedelta(days=3), 20)
+            test_session.commit()
+            fill_request(test_session, route.move_requests[-1])
+            test_session.commit()
+            second = cache.get(test_session, receiver)
+            assert second is not first
+            assert second['supply'].sum() == first['supply'].sum() + 20
+            assert cache.get(test_session, sender).to_frame().equals(ProjectionCTP(test_session, sender).df)
+
+            order = route.move_requests[-1].move_orders[-1]
+            execute_move(test_session, order)
+            test_session.commit()
+            third = cache.get(test_session, receiver)
+            assert third is not second
+
+            # So do direct edits of stock and routes, without any helper function
+            receiver.current_stock += 5
+            test_session.commit()
+            fourth = cache.get(test_session, receiver)
+            assert fourth is not third and fourth['inventory'][0] == third['inventory'][0] + 5
+            route.capacity += 10
+            test_session.commit()
+            assert cache.get(test_session, receiver) is not fourth
+
+            # Least recently used entries are evicted: with room for two, the sender is gone after two others
+            cache = ProjectionCache(maxsize=2)
+            cache.get(test_session, sender)
+            cache.get(test_session, receiver)
+            cache.get(test_session, get_all(test_session, StockPoint)[-1])
+            misses = cache.misses
+            cache.get(test_session, receiver)
+            assert cache.misses == misses
+            cache.get(test_session, sender)
+            assert cache.misses == misses + 1
+
+        # Resetting the database invalidates everything
+        with Session(test_engine) as test_session:
+            reset_and_fill_db(test_engine, test_session, [ProductA])
+            test_session.commit()
+            misses = cache.misses
+            cache.get(test_session, get_all(test_session, StockPoint)[0])
+            assert cache.misses == misses + 1
+
+        reset_db(test_engine)
+
+    def test_separate_engines(self):
+        # Two in-memory databases share a url and stockpoint ids, but not their contents
+        engines = [create_engine("sqlite+pysqlite:///:memory:") for _ in range(2)]
+        for engine in engines:
+            fill_db_if_empty(engine, [ProductA])
+        with Session(engines[1]) as session:
+            get_all(session, StockPoint)[0].current_stock += 5
+            session.commit()
+
+        cache = ProjectionCache()
+        results = []
+        for engine in engines:
+            with Session(engine) as session:
+                results.append(cache.get(session, get_all(session, StockPoint)[0]))
+        assert cache.misses == 2
+        assert results[1]['inventory'][0] == results[0]['inventory'][0] + 5
+
+        # A write to one of them leaves the other's entries valid
+        with Session(engines[1]) as session:
+            get_all(session, StockPoint)[0].current_stock += 5
+            session.commit()
+        with Session(engines[0]) as session:
+            assert cache.get(session, get_all(session, StockPoint)[0]) is results[0]
+        for engine in engines:
+            engine.dispose()
+
+    def test_compact_result(self):
+        with Session(test_engine) as init_session:
+            reset_and_fill_db(test_engine, init_session, [ProductA, BranchingProduct])
+            init_session.commit()
+
+        with Session(test_engine) as test_session:
+            for stockpoint in get_all(test_session, StockPoint):
+                for projection in [ProjectionATP(test_session, stockpoint),
+                                   ProjectionCTP(test_session, stockpoint, horizon=30, bucket='week')]:
+                    result = projection.result()
+                    assert result.to_frame().equals(projection.df)
+                    assert result.final_date == projection.final_date and repr(result) == repr(projection)
+                    assert result.values.dtype == np.int32 and result.values.flags['C_CONTIGUOUS']
+                    assert (result['inventory'] == projection.df['inventory']).all()
+
+                    moves = result.included_moves
+                    assert moves.dtype == moves_dtype
+                    assert sorted(moves['id']) == sorted(move['id'] for move in projection.included_moves)
+                    receipts = moves[moves['direction'] == 1]
+                    assert receipts['quantity'].sum() == projection.df['supply'].sum()
+                    assert -moves['quantity'][moves['direction'] == -1].sum() == projection.df['demand'].sum()
+
+            # Quantities beyond int32 are kept as int64
+            projection = ProjectionATP(test_session, get_all(test_session, StockPoint)[0])
+            projection.df['inventory'] += 2**40
+            assert projection.result().to_frame().equals(projection.df)
+
+        reset_db(test_engine)
+
+
+class TestPlotPayload:
+    def test_packed_columns(self):
+        with Session(test_engine) as init_session:
+            reset_and_fill_db(test_engine, init_session, [BranchingProduct])
+            init_session.commit()
+
+        with Session(test_engine) as test_session:
+            for stockpoint in get_all(test_session, StockPoint):
+                for horizon, bucket in [(365, 'day'), (12, 'month')]:
+                    result = ProjectionCTP(test_session, stockpoint, horizon=horizon, bucket=bucket).result()
+                    frame = result.to_frame()
+                    for columns, plot_period in [(plotable_columns, 366), (['supply', 'CTP'], 24)]:
+                        plot_data, y_min, y_max = plot_payload(result, columns, plot_period)
+
+                        fields, packed_columns = json.loads(plot_data.removeprefix('cols:'))
+                        window = frame[columns].iloc[:plot_period]
+                        assert fields == columns + ['date']
+                        assert packed_columns[:-1] == window.to_numpy().T.tolist()
+                        assert packed_columns[-1] == [day.date().isoformat() for day in window.index]
+                        assert y_min == min(0, int(window.to_numpy().min() * 1.1))
+                        assert y_max == max(20, int(window.to_numpy().max() * 1.1))
+
+        reset_db(test_engine)
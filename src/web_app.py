@@ -1,36 +1,35 @@
+import asyncio
+import logging
+
 from h2o_wave import main, Q, app, ui, copy_expando
 
 from .databasing import database_model as dbm
 from .databasing.premade_db_content import ProductA, FakeProduct, BranchingProduct
-from .pages.shared_content import get_selected, DbContent, force_select_child_in_selected_parent
+from .pages.shared_content import get_selected, DbContent, force_select_child_in_selected_parent, show_card, rebuild_page
 from .pages import order_page as orderpage
 from .pages import supply_chain_page as sc_page
 from .pages import inventory_page as plotpage
 
+logger = logging.getLogger(__name__)
+
 
 @app('/', mode='unicast')
 async def serve_ctp(q: Q):
 
-    """ Run once, on startup """
+    """ Run once per process: the database engine and its connection pool are shared by all clients """
+    if not q.app.initialized:
+        q.app.db_engine = dbm.create_app_engine()
+        dbm.fill_db_if_empty(q.app.db_engine, [ProductA, FakeProduct, BranchingProduct])
+        q.app.initialized = True
+
+    """ Run once per client """
     if not q.client.initialized:
         q.client.initialized = True
 
-        # Database  initialization
-        url_object = dbm.URL.create(
-            "sqlite+pysqlite",
-            username=None,
-            password=None,  # plain (unescaped) text
-            host=None,
-            database="memory",
-        ) # "sqlite+pysqlite:///:memory:"
-        q.user.db_engine = dbm.create_engine(url_object, echo=False, future=True)
-        
-        dbm.reset_db(q.user.db_engine)
-        with dbm.Session(q.user.db_engine) as init_session:
-            dbm.add_from_class(init_session, ProductA)
-            dbm.add_from_class(init_session, FakeProduct)
-            dbm.add_from_class(init_session, BranchingProduct)
-            init_session.commit()
+        # Cards as last sent to this client, so that only their changes are sent
+        q.client.shown_cards = {}
+        # One request at a time per client, as they share the client's state and page
+        q.client.request_lock = asyncio.Lock()
 
         # UI initialization
         q.client.product_selection = 1
@@ -39,7 +38,16 @@ async def serve_ctp(q: Q):
         q.client.plot_length = 12
         q.client.plot_columns = plotpage.plotable_columns
 
-    with dbm.Session(q.user.db_engine) as ui_session:
+    """ Database work and cards are done in a worker thread, so that a slow request does not block other clients """
+    async with q.client.request_lock:
+        q.client.bytes_sent = 0
+        await q.run(serve_request, q)
+        await q.page.save()
+        logger.info(f"Sent {q.client.bytes_sent:,} bytes of card updates for #{q.args['#'] or 'inventory_page'}")
+
+
+def serve_request(q: Q):
+    with dbm.Session(q.app.db_engine) as ui_session:
 
         """ Data updates on user action """
         copy_expando(q.args, q.client)
@@ -48,21 +56,24 @@ async def serve_ctp(q: Q):
 
         """ UI response on user action """
         page_hash = q.args['#']
+        if page_hash != q.client.shown_page_hash:
+            # Navigation replaces most cards anyway: a good moment to resync the page with the Wave server
+            rebuild_page(q)
+            q.client.shown_page_hash = page_hash
 
         if page_hash == 'sc_page':
             sc_page.layout(q)
-            await sc_page.serve_supply_chain_page(q, ui_session)
+            sc_page.serve_supply_chain_page(q, ui_session)
 
         elif page_hash == 'order_page':  # ->
             orderpage.layout(q)
-            await orderpage.serve_order_page(q, ui_session)
+            orderpage.serve_order_page(q, ui_session)
 
         elif page_hash == 'inventory_page' or page_hash is None:  #
             plotpage.layout(q)
-            await plotpage.serve_inventory_page(q, ui_session, db_content)
+            plotpage.serve_inventory_page(q, ui_session, db_content)
 
         show_header(q)
-        await q.page.save()
 
 
 def show_header(q: Q):
@@ -74,8 +85,8 @@ def show_header(q: Q):
     }
     pagination_items = [ui.button(name=f'#{page_hash}',label=hash_to_label[page_hash], link=True)
                         for page_hash in hash_to_label]
-    q.page['header'] = ui.header_card(box='header_zone',
-                                      title=hash_to_label[page_hash] if page_hash else 'Inventories',
-                                      subtitle='',
-                                      items=pagination_items
-                                      )
+    show_card(q, 'header', ui.header_card(box='header_zone',
+                                          title=hash_to_label[page_hash] if page_hash else 'Inventories',
+                                          subtitle='',
+                                          items=pagination_items
+                                          ))